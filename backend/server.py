@@ -1,17 +1,46 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, EmailStr
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.monitoring import ConnectionPoolListener
 from bson import ObjectId
+from gridfs.errors import NoFile
 from datetime import datetime, timedelta
 from typing import List, Optional
 from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+import asyncio
 import base64
+import binascii
+import calendar
+import codecs
+import collections
+import contextvars
+import csv
+import hashlib
+import hmac
+import io
+import json
+import orjson
 import os
+import random
+import socket
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
 import re
+from sms_parser import parse_sms_with_rules
+from receipt_image import preprocess_receipt
 
 load_dotenv()
 
@@ -27,16 +56,428 @@ app.add_middleware(
 )
 
 # MongoDB connection
+# The pool is sized from the environment and warmed up on startup (see
+# warm_up_mongo), so the first requests after a deploy don't pay for
+# connection setup and server selection.
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.budget_planner
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "budget_planner")
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 10))
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 5 * 60 * 1000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+
+class PoolStats(ConnectionPoolListener):
+    """Connection pool counters for the readiness endpoint.
+    
+    pymongo calls these hooks from its own threads, hence the lock.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"open": 0, "checkedOut": 0, "checkOutFailures": 0, "waitTimeouts": 0, "poolCleared": 0}
+    
+    def add(self, key, amount=1):
+        with self.lock:
+            self.counts[key] += amount
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+    
+    def connection_created(self, event):
+        self.add("open")
+    
+    def connection_closed(self, event):
+        self.add("open", -1)
+    
+    def connection_checked_out(self, event):
+        self.add("checkedOut")
+    
+    def connection_checked_in(self, event):
+        self.add("checkedOut", -1)
+    
+    def connection_check_out_failed(self, event):
+        self.add("checkOutFailures")
+        if event.reason == "timeout":
+            self.add("waitTimeouts")
+    
+    def pool_cleared(self, event):
+        self.add("poolCleared")
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_check_out_started(self, event):
+        pass
+
+pool_stats = PoolStats()
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    event_listeners=[pool_stats]
+)
+db = client[MONGO_DB_NAME]
+
+async def warm_up_mongo():
+    """Select a server and open MONGO_MIN_POOL_SIZE connections up front"""
+    start = time.perf_counter()
+    # Concurrent pings each need their own connection
+    await asyncio.gather(*[
+        client.admin.command("ping") for _ in range(max(1, MONGO_MIN_POOL_SIZE))
+    ])
+    print(f"MongoDB warm-up: {pool_stats.snapshot()['open']} connections open in "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+# Metrics
+# Prometheus metrics for this worker, served on /metrics. Labels are limited
+# to route templates (never raw paths), collection and operation names and LLM
+# call kinds, so the number of series stays fixed however the API is used.
+# Documents are counted as returned or written by each operation, per route,
+# which shows which endpoints pull the most data out of MongoDB.
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response starts",
+    ["method", "route", "status"]
+)
+mongo_operation_duration = Histogram(
+    "mongo_operation_duration_seconds", "MongoDB operation latency",
+    ["collection", "operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+mongo_documents = Counter(
+    "mongo_documents_total", "Documents returned or written by MongoDB operations",
+    ["route", "collection", "operation"]
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds", "LLM send_message latency",
+    ["kind", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+)
+# ASGI scope of the request being handled; its "route" names the template
+current_scope = contextvars.ContextVar("current_scope", default=None)
+
+def current_route():
+    scope = current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route else "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    token = current_scope.set(request.scope)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_request_duration.labels(request.method, current_route(), str(status)).observe(
+            time.perf_counter() - start
+        )
+        current_scope.reset(token)
+
+def documents_in(result):
+    """Number of documents a collection method returned or wrote"""
+    if result is None:
+        return 0
+    if isinstance(result, int):
+        return result
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, (dict, InsertOneResult)):
+        return 1
+    if isinstance(result, InsertManyResult):
+        return len(result.inserted_ids)
+    if isinstance(result, DeleteResult):
+        return result.deleted_count
+    if isinstance(result, UpdateResult):
+        return result.matched_count + (1 if result.upserted_id is not None else 0)
+    if isinstance(result, BulkWriteResult):
+        return result.inserted_count + result.matched_count + result.upserted_count + result.deleted_count
+    return 0
+
+def record_mongo_operation(collection, operation, seconds, documents, query=None, explain=None):
+    mongo_operation_duration.labels(collection, operation).observe(seconds)
+    if documents:
+        mongo_documents.labels(current_route(), collection, operation).inc(documents)
+    check_query_plan(collection, operation, seconds, documents, query, explain)
+
+class TimedCursor:
+    """Motor cursor that records its fetch time and document count.
+
+    Chained calls (sort, limit, batch_size, ...) return the wrapper. Time
+    spent in async iteration is summed and recorded once the cursor is
+    exhausted. query and explain are passed on to the slow query log.
+    """
+    def __init__(self, cursor, collection, operation, query, explain):
+        self.cursor = cursor
+        self.collection = collection
+        self.operation = operation
+        self.query = query
+        self.explain = explain
+        self.iterator = None
+        self.seconds = 0.0
+        self.documents = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.cursor, name)
+        if not callable(attr):
+            return attr
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self.cursor else result
+        return chained
+
+    async def to_list(self, length=None):
+        start = time.perf_counter()
+        docs = await self.cursor.to_list(length=length)
+        record_mongo_operation(
+            self.collection, self.operation, time.perf_counter() - start, len(docs), self.query, self.explain
+        )
+        return docs
+
+    def __aiter__(self):
+        self.iterator = self.cursor.__aiter__()
+        return self
+
+    async def __anext__(self):
+        start = time.perf_counter()
+        try:
+            doc = await self.iterator.__anext__()
+        except StopAsyncIteration:
+            self.seconds += time.perf_counter() - start
+            record_mongo_operation(
+                self.collection, self.operation, self.seconds, self.documents, self.query, self.explain
+            )
+            raise
+        self.seconds += time.perf_counter() - start
+        self.documents += 1
+        return doc
+
+class TimedCollection:
+    """Motor collection wrapper that records per-operation latency and documents"""
+    OPERATIONS = {
+        "find_one", "insert_one", "insert_many", "update_one", "update_many",
+        "replace_one", "delete_one", "delete_many", "find_one_and_update",
+        "find_one_and_delete", "find_one_and_replace", "count_documents",
+        "distinct", "bulk_write", "estimated_document_count"
+    }
+    CURSOR_OPERATIONS = {"find", "aggregate"}
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def explain_command(self, operation, args, kwargs):
+        """The command to explain for an operation, or None if it has no query"""
+        query = args[0] if args else kwargs.get("filter", kwargs.get("pipeline", {}))
+        if operation == "aggregate":
+            return {"aggregate": self.name, "pipeline": query, "cursor": {}}
+        if operation == "count_documents":
+            return {"count": self.name, "query": query}
+        if operation == "distinct":
+            return {"distinct": self.name, "key": query, "query": args[1] if len(args) > 1 else kwargs.get("filter", {})}
+        if operation.startswith("insert") or operation in ("bulk_write", "estimated_document_count"):
+            return None
+        # Updates and deletes are explained as the find that locates their targets
+        command = {"find": self.name, "filter": query or {}}
+        if operation.endswith("_one") or operation.startswith("find_one"):
+            command["limit"] = 1
+        return command
+
+    def explainer(self, command):
+        if command is None:
+            return None
+        return lambda: self.collection.database.command({"explain": command, "verbosity": "executionStats"})
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name in self.CURSOR_OPERATIONS:
+            def cursor_operation(*args, **kwargs):
+                cursor = attr(*args, **kwargs)
+                command = self.explain_command(name, args, kwargs)
+                # A find cursor explains itself, including its sort and limit
+                explain = getattr(cursor, "explain", None) if name == "find" else self.explainer(command)
+                return TimedCursor(cursor, self.name, name, command.get("filter", command.get("pipeline")), explain)
+            return cursor_operation
+        if name in self.OPERATIONS:
+            async def operation(*args, **kwargs):
+                start = time.perf_counter()
+                result = await attr(*args, **kwargs)
+                command = self.explain_command(name, args, kwargs)
+                record_mongo_operation(
+                    self.name, name, time.perf_counter() - start, documents_in(result),
+                    command and command.get("filter", command.get("query", command.get("pipeline"))),
+                    self.explainer(command)
+                )
+                return result
+            return operation
+        return attr
+
+class TimedChat:
+    """Records the latency of every send_message call on an LLM chat"""
+    def __init__(self, chat, kind):
+        self.chat = chat
+        self.kind = kind
+
+    async def send_message(self, message):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self.chat.send_message(message)
+            outcome = "ok"
+            return response
+        finally:
+            llm_request_duration.labels(self.kind, outcome).observe(time.perf_counter() - start)
+
+# Slow query log
+# Operations slower than SLOW_QUERY_MS are logged with their route, the shape
+# of their filter (values replaced by type names) and how many documents they
+# returned. With SLOW_QUERY_EXPLAIN=1 they are also explained (executionStats)
+# to show how many documents the server examined; that re-runs the query, so
+# it is off by default. EXPLAIN_SAMPLE_RATE explains that fraction of all
+# queries, however fast, and flags collection scans: a COLLSCAN on a small
+# test collection is cheap now and a full scan per request once data grows.
+# At most EXPLAIN_CONCURRENCY explains run at once and the rest are skipped.
+# GET /api/stats/slow-queries returns the recent log.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 100))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1"
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", 200))
+EXPLAIN_SAMPLE_RATE = float(os.getenv("EXPLAIN_SAMPLE_RATE", 0))
+EXPLAIN_CONCURRENCY = int(os.getenv("EXPLAIN_CONCURRENCY", 2))
+slow_query_log = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+query_plan_stats = {"slow": 0, "explained": 0, "explainSkipped": 0, "explainErrors": 0, "collscans": 0}
+explain_tasks = set()
+mongo_slow_operations = Counter(
+    "mongo_slow_operations_total", "MongoDB operations slower than SLOW_QUERY_MS",
+    ["route", "collection", "operation"]
+)
+mongo_collscans = Counter(
+    "mongo_collscans_total", "Explained MongoDB operations whose plan scans the whole collection",
+    ["route", "collection", "operation"]
+)
+
+def query_shape(value):
+    """The query with its values replaced by type names"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return "array"
+    return type(value).__name__
+
+def plan_summary(explain):
+    """Plan stages, documents examined and returned from explain output"""
+    summary = {"stages": [], "docsExamined": 0, "nReturned": None}
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            stage = node.get("stage")
+            # Uppercase names are classic plan stages; SBE stages are lowercase
+            if isinstance(stage, str) and stage.isupper() and stage not in summary["stages"]:
+                summary["stages"].append(stage)
+            for key, item in node.items():
+                if key in ("rejectedPlans", "allPlansExecution"):
+                    continue
+                if key == "totalDocsExamined":
+                    summary["docsExamined"] += item
+                elif key == "nReturned" and summary["nReturned"] is None and "totalDocsExamined" in node:
+                    summary["nReturned"] = item
+                else:
+                    walk(item)
+    walk(explain)
+    return summary
+
+def check_query_plan(collection, operation, seconds, documents, query, explain):
+    """Log the operation if it was slow and explain it if slow or sampled"""
+    slow = seconds * 1000 >= SLOW_QUERY_MS
+    sampled = explain is not None and EXPLAIN_SAMPLE_RATE > 0 and random.random() < EXPLAIN_SAMPLE_RATE
+    if not slow and not sampled:
+        return
+    
+    route = current_route()
+    entry = {
+        "at": datetime.utcnow().isoformat(),
+        "route": route,
+        "collection": collection,
+        "operation": operation,
+        "filter": query_shape(query) if query is not None else None,
+        "durationMs": round(seconds * 1000, 1),
+        "nReturned": documents,
+        "docsExamined": None,
+        "slow": slow
+    }
+    if slow:
+        query_plan_stats["slow"] += 1
+        mongo_slow_operations.labels(route, collection, operation).inc()
+    if explain is None or not (sampled or SLOW_QUERY_EXPLAIN):
+        log_query(entry)
+        return
+    if len(explain_tasks) >= EXPLAIN_CONCURRENCY:
+        query_plan_stats["explainSkipped"] += 1
+        if slow:
+            log_query(entry)
+        return
+    task = asyncio.create_task(explain_query(entry, explain))
+    explain_tasks.add(task)
+    task.add_done_callback(explain_tasks.discard)
+
+async def explain_query(entry, explain):
+    try:
+        summary = plan_summary(await explain())
+    except Exception as e:
+        query_plan_stats["explainErrors"] += 1
+        entry["explainError"] = str(e)
+        if entry["slow"]:
+            log_query(entry)
+        return
+    query_plan_stats["explained"] += 1
+    entry.update({
+        "docsExamined": summary["docsExamined"],
+        "planStages": summary["stages"],
+        "collscan": "COLLSCAN" in summary["stages"]
+    })
+    if summary["nReturned"] is not None:
+        entry["nReturned"] = summary["nReturned"]
+    if entry["collscan"]:
+        query_plan_stats["collscans"] += 1
+        mongo_collscans.labels(entry["route"], entry["collection"], entry["operation"]).inc()
+    if entry["slow"] or entry["collscan"]:
+        log_query(entry)
+
+def log_query(entry):
+    slow_query_log.append(entry)
+    label = "Slow query" if entry["slow"] else "Collection scan"
+    print(f"{label}: {json.dumps(entry, default=str)}")
 
 # Collections
-transactions_collection = db.transactions
-categories_collection = db.categories
-bills_collection = db.bills
-upi_payments_collection = db.upi_payments
-users_collection = db.users
+transactions_collection = TimedCollection(db.transactions)
+categories_collection = TimedCollection(db.categories)
+bills_collection = TimedCollection(db.bills)
+upi_payments_collection = TimedCollection(db.upi_payments)
+users_collection = TimedCollection(db.users)
+rollups_collection = TimedCollection(db.monthly_rollups)
+jobs_collection = TimedCollection(db.scheduled_jobs)
+insights_cache_collection = TimedCollection(db.ai_insights_cache)
+insights_jobs_collection = TimedCollection(db.ai_insights_jobs)
+parse_cache_collection = TimedCollection(db.parse_cache)
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -130,11 +571,408 @@ def serialize_doc(doc):
         doc["_id"] = str(doc["_id"])
     return doc
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Create and update endpoints echo back the document they wrote instead of
+# reading it again. READ_AFTER_WRITE=1 restores the extra find_one, e.g. for
+# tests that compare the response with what the database actually holds.
+READ_AFTER_WRITE = os.getenv("READ_AFTER_WRITE", "0") == "1"
+
+async def written_doc(collection, doc, fields):
+    """Return the public fields of the document just written (doc must include
+    its _id), the same shape list endpoints return by default"""
+    if READ_AFTER_WRITE:
+        return await collection.find_one({"_id": doc["_id"]}, dict.fromkeys(fields, 1))
+    return {"_id": doc["_id"], **{field: doc[field] for field in fields if field in doc}}
+
+# List endpoints return the fields below unless the client asks for fewer with
+# ?fields=a,b,c; _id is always included. Internal fields (occurredAt, dueAt,
+# billMonth, imageContentType) are never listed.
+TRANSACTION_FIELDS = ("type", "amount", "category", "description", "date", "imageId", "createdAt")
+BILL_FIELDS = (
+    "name", "amount", "dueDate", "isPaid", "category", "reminderSet", "source",
+    "isRecurring", "recurringDay", "parentBillId", "createdAt"
+)
+UPI_PAYMENT_FIELDS = ("amount", "recipient", "upiId", "date", "status", "createdAt")
+CATEGORY_FIELDS = ("name", "type", "icon", "color")
+
+def fields_projection(fields, allowed):
+    """Mongo projection for a comma-separated fields parameter"""
+    requested = [field.strip() for field in (fields or "").split(",") if field.strip()]
+    if not requested:
+        # An empty projection would return every field, internal ones included
+        return dict.fromkeys(allowed, 1)
+    unknown = [field for field in requested if field not in allowed and field != "_id"]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return dict.fromkeys(requested, 1)
+
+class MongoJSONResponse(ORJSONResponse):
+    """orjson response that converts ObjectIds while encoding, so documents can
+    be returned straight from Motor without a serialize_doc pass"""
+    def render(self, content):
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+# Dates are stored as "YYYY-MM-DD" strings for the app, plus a native datetime
+# copy (occurredAt on transactions, dueAt on bills) so month filters can be
+# indexed range queries instead of regex prefix scans.
+def parse_date(value):
+    """Parse the YYYY-MM-DD part of a date string, or None if it isn't one.
+    
+    Any string starting with a valid YYYY-MM gets a date in that month, as it
+    matched the old regex month filters: days past the end of the month
+    (2025-02-31) are clamped to its last day, and a missing day counts as
+    the 1st.
+    """
+    try:
+        month = datetime.strptime(value[:7], "%Y-%m")
+    except (TypeError, ValueError):
+        return None
+    day = value[8:10]
+    day = int(day) if day.isdigit() else 1
+    return month.replace(day=min(max(day, 1), days_in_month(month)))
+
+def is_iso_date(value):
+    """True if value is exactly a real YYYY-MM-DD date"""
+    try:
+        return len(value) == 10 and bool(datetime.strptime(value, "%Y-%m-%d"))
+    except ValueError:
+        return False
+
+def days_in_month(date):
+    return calendar.monthrange(date.year, date.month)[1]
+
+def month_range(month):
+    """Return a {$gte, $lt} range query covering a YYYY-MM month"""
+    try:
+        start = datetime.strptime(month, "%Y-%m")
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid month, expected YYYY-MM")
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return {"$gte": start, "$lt": end}
+
+def transaction_doc(transaction: Transaction, user_id):
+    """Transaction document without the image; see store_transaction_image"""
+    doc = transaction.dict(exclude={"imageBase64"})
+    doc["userId"] = user_id
+    doc["occurredAt"] = parse_date(doc["date"])
+    return doc
+
+def bill_doc(bill: Bill, user_id):
+    doc = bill.dict()
+    doc["userId"] = user_id
+    doc["dueAt"] = parse_date(doc["dueDate"])
+    return doc
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# Keyset pagination: the cursor is the (date, _id) of the last item returned,
+# so each page is an index seek instead of a growing skip.
+# Transaction pages are sorted on (occurredAt, _id), the same field month
+# filters use, so one index serves both. Transactions whose date couldn't be
+# parsed have no occurredAt and sort last.
+def encode_cursor(doc):
+    occurred_at = doc.get("occurredAt")
+    raw = json.dumps([occurred_at.isoformat() if occurred_at else None, str(doc["_id"])])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def cursor_query(cursor):
+    try:
+        occurred_at, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        occurred_at = datetime.fromisoformat(occurred_at) if occurred_at else None
+        last_id = ObjectId(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if occurred_at is None:
+        return {"occurredAt": None, "_id": {"$lt": last_id}}
+    return {"$or": [
+        {"occurredAt": {"$lt": occurred_at}},
+        {"occurredAt": occurred_at, "_id": {"$lt": last_id}},
+        {"occurredAt": None}
+    ]}
+
+async def run_migration_once(name, migration):
+    """Run a startup migration unless its marker in scheduled_jobs says it already ran.
+    
+    Workers starting together may both run it, so migrations must be
+    idempotent. The matching maintenance command reruns it unconditionally.
+    """
+    if await jobs_collection.find_one({"_id": name}, {"_id": 1}):
+        return
+    await migration()
+    await jobs_collection.update_one({"_id": name}, {"$set": {"completedAt": datetime.utcnow()}}, upsert=True)
+
+async def backfill_date_fields():
+    """Migration: add occurredAt/dueAt/billMonth to documents created before they existed"""
+    updated = 0
+    for collection, source, target in [
+        (transactions_collection, "date", "occurredAt"),
+        (bills_collection, "dueDate", "dueAt"),
+    ]:
+        operations = []
+        # null covers dates that didn't parse before parse_date clamped days;
+        # dates that still don't parse are left as they are
+        async for doc in collection.find({target: None}, {source: 1}):
+            parsed = parse_date(doc.get(source))
+            if parsed is None:
+                continue
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {target: parsed}}))
+            if len(operations) == 1000:
+                updated += (await collection.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        if operations:
+            updated += (await collection.bulk_write(operations, ordered=False)).modified_count
+    
+    # Generated recurring instances are keyed on (parentBillId, billMonth)
+    operations = []
+    async for bill in bills_collection.find(
+        {"parentBillId": {"$type": "string"}, "billMonth": {"$exists": False}},
+        {"dueDate": 1}
+    ):
+        operations.append(UpdateOne(
+            {"_id": bill["_id"]},
+            {"$set": {"billMonth": bill["dueDate"][:7]}}
+        ))
+    if operations:
+        updated += (await bills_collection.bulk_write(operations, ordered=False)).modified_count
+    return updated
+
+# Monthly rollups: one document per (userId, month, type, category) holding the
+# running total and count, so analytics reads scale with months x categories
+# instead of the number of transactions.
+def rollup_key(transaction):
+    return {
+        "userId": transaction.get("userId"),
+        "month": transaction["date"][:7],
+        "type": transaction["type"],
+        "category": transaction.get("category", "Other"),
+    }
+
+async def apply_to_rollups(transaction, sign=1):
+    """Add (sign=1) or remove (sign=-1) a transaction from the monthly rollups"""
+    key = rollup_key(transaction)
+    await rollups_collection.update_one(
+        key,
+        {"$inc": {"total": sign * transaction["amount"], "count": sign}},
+        upsert=True
+    )
+    if sign < 0:
+        await rollups_collection.delete_one({**key, "count": {"$lte": 0}})
+
+async def add_many_to_rollups(transactions):
+    """Add a batch of new transactions to the monthly rollups in one bulk write"""
+    totals = {}
+    for transaction in transactions:
+        key = tuple(rollup_key(transaction).items())
+        total, count = totals.get(key, (0, 0))
+        totals[key] = (total + transaction["amount"], count + 1)
+    if totals:
+        await rollups_collection.bulk_write([
+            UpdateOne(dict(key), {"$inc": {"total": total, "count": count}}, upsert=True)
+            for key, (total, count) in totals.items()
+        ], ordered=False)
+
+async def rebuild_rollups():
+    """Recompute all monthly rollups from the transactions collection.
+    
+    The rollups are built into a temporary collection that then replaces
+    monthly_rollups in one rename, so readers never see them half built and
+    several workers can rebuild at once. A transaction written while the
+    aggregation runs can still be missed; rebuild again if that matters.
+    """
+    staging = rollups_collection.database[f"{rollups_collection.name}_rebuild_{uuid.uuid4().hex}"]
+    # $out keeps the indexes of an existing target, so the rename keeps the
+    # unique index too
+    await staging.create_index(
+        [("userId", 1), ("month", 1), ("type", 1), ("category", 1)], unique=True
+    )
+    pipeline = [
+        {"$project": {"userId": 1, "date": 1, "type": 1, "category": 1, "amount": 1}},
+        {"$group": {
+            "_id": {
+                "userId": "$userId",
+                "month": {"$substr": ["$date", 0, 7]},
+                "type": "$type",
+                "category": {"$ifNull": ["$category", "Other"]},
+            },
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": 0,
+            "userId": "$_id.userId",
+            "month": "$_id.month",
+            "type": "$_id.type",
+            "category": "$_id.category",
+            "total": 1,
+            "count": 1,
+        }},
+        {"$out": staging.name},
+    ]
+    try:
+        await transactions_collection.aggregate(pipeline).to_list(length=None)
+        count = await staging.count_documents({})
+        await staging.rename(rollups_collection.name, dropTarget=True)
+    except Exception:
+        await staging.drop()
+        raise
+    return count
+
+# Receipt images
+# Receipt photos are kept out of transaction documents: the bytes go to GridFS
+# (or a local directory with RECEIPT_STORE=local) and the transaction only
+# holds imageId/imageContentType, so list and analytics queries never load
+# image data. GET /api/transactions/{id}/image streams the photo back.
+RECEIPT_STORE = os.getenv("RECEIPT_STORE", "gridfs")
+RECEIPT_STORE_PATH = os.getenv(
+    "RECEIPT_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "receipt_images")
+)
+RECEIPT_CHUNK_SIZE = 255 * 1024
+receipts_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="receipts") if RECEIPT_STORE == "gridfs" else None
+
+# Documents written before images moved out may still carry inline imageBase64
+WITHOUT_IMAGE = {"imageBase64": 0}
+
+def decode_image(image_base64):
+    """Return (bytes, content type) for a base64 string or data URL"""
+    content_type = "image/jpeg"
+    if image_base64.startswith("data:"):
+        header, _, image_base64 = image_base64.partition(",")
+        content_type = header[5:].split(";")[0] or content_type
+    try:
+        return base64.b64decode(image_base64), content_type
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid imageBase64")
+
+def receipt_image_path(image_id):
+    return os.path.join(RECEIPT_STORE_PATH, os.path.basename(image_id))
+
+async def save_receipt_image(data):
+    """Store image bytes and return the reference to keep on the transaction"""
+    if RECEIPT_STORE == "local":
+        image_id = uuid.uuid4().hex
+        
+        def write():
+            os.makedirs(RECEIPT_STORE_PATH, exist_ok=True)
+            with open(receipt_image_path(image_id), "wb") as f:
+                f.write(data)
+        
+        await asyncio.to_thread(write)
+        return image_id
+    return str(await receipts_bucket.upload_from_stream(f"receipt-{uuid.uuid4().hex}", data))
+
+async def open_receipt_image(image_id):
+    """Return an async iterator over the stored image's chunks, or None if it is missing"""
+    if RECEIPT_STORE == "local":
+        try:
+            f = await asyncio.to_thread(open, receipt_image_path(image_id), "rb")
+        except FileNotFoundError:
+            return None
+        
+        async def chunks():
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, RECEIPT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                f.close()
+        return chunks()
+    
+    try:
+        grid_out = await receipts_bucket.open_download_stream(ObjectId(image_id))
+    except NoFile:
+        return None
+    
+    async def chunks():
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    return chunks()
+
+async def delete_receipt_image(image_id):
+    try:
+        if RECEIPT_STORE == "local":
+            await asyncio.to_thread(os.remove, receipt_image_path(image_id))
+        else:
+            await receipts_bucket.delete(ObjectId(image_id))
+    except (FileNotFoundError, NoFile):
+        pass
+
+async def store_transaction_image(doc, transaction: Transaction):
+    """Save the transaction's imageBase64, if any, and reference it from doc"""
+    if transaction.imageBase64:
+        data, content_type = decode_image(transaction.imageBase64)
+        doc["imageId"] = await save_receipt_image(data)
+        doc["imageContentType"] = content_type
+    return doc
+
+async def migrate_receipt_images():
+    """Migration: move inline imageBase64 from transactions into the receipt store"""
+    migrated = 0
+    # A few documents per batch; each one can be several MB
+    cursor = transactions_collection.find(
+        {"imageBase64": {"$type": "string"}}, {"imageBase64": 1}
+    ).batch_size(10)
+    async for doc in cursor:
+        try:
+            data, content_type = decode_image(doc["imageBase64"])
+        except HTTPException:
+            print(f"Error migrating receipt image of transaction {doc['_id']}: invalid base64")
+            continue
+        image_id = await save_receipt_image(data)
+        await transactions_collection.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"imageId": image_id, "imageContentType": content_type}, "$unset": {"imageBase64": ""}}
+        )
+        migrated += 1
+    # Transactions without a photo used to store imageBase64: null
+    await transactions_collection.update_many(
+        {"imageBase64": {"$exists": True, "$eq": None}}, {"$unset": {"imageBase64": ""}}
+    )
+    return migrated
+
+# Password hashing
+# bcrypt takes hundreds of milliseconds per call, so it runs on its own thread
+# pool (bcrypt releases the GIL) instead of blocking the event loop. At most
+# PASSWORD_HASH_WORKERS hashes run at once; callers beyond that wait their
+# turn, and past PASSWORD_HASH_MAX_WAITING waiters new ones get a 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+PASSWORD_HASH_MAX_WAITING = int(os.getenv("PASSWORD_HASH_MAX_WAITING", 200))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_hash_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+password_hash_stats = {"waiting": 0, "maxWaiting": 0, "running": 0, "completed": 0, "rejected": 0}
+
+async def run_password_hash(func, *args):
+    if password_hash_stats["waiting"] >= PASSWORD_HASH_MAX_WAITING:
+        password_hash_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Too many sign-in attempts, please retry", headers={"Retry-After": "1"})
+    
+    password_hash_stats["waiting"] += 1
+    password_hash_stats["maxWaiting"] = max(password_hash_stats["maxWaiting"], password_hash_stats["waiting"])
+    try:
+        await password_hash_slots.acquire()
+    finally:
+        password_hash_stats["waiting"] -= 1
+    
+    password_hash_stats["running"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_hash_stats["running"] -= 1
+        password_hash_stats["completed"] += 1
+        password_hash_slots.release()
+
+async def verify_password(plain_password, hashed_password):
+    return await run_password_hash(pwd_context.verify, plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await run_password_hash(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -146,6 +984,41 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Authenticated user cache
+# get_current_user runs on every authenticated request, so user records are
+# cached per JWT subject, and unknown subjects briefly, so a burst of tokens
+# for a deleted user doesn't turn into a burst of queries. Code that changes
+# or creates a user calls invalidate_user(); other workers pick the change up
+# when their entry expires.
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+USER_NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv("USER_NEGATIVE_CACHE_TTL_SECONDS", 5))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+missing_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_NEGATIVE_CACHE_TTL_SECONDS)
+user_cache_stats = {"hits": 0, "negativeHits": 0, "misses": 0}
+
+def invalidate_user(email):
+    user_cache.pop(email, None)
+    missing_user_cache.pop(email, None)
+
+async def find_user(email):
+    """Return a copy of the user with this email, or None, via the user cache"""
+    user = user_cache.get(email)
+    if user is not None:
+        user_cache_stats["hits"] += 1
+        return dict(user)
+    if email in missing_user_cache:
+        user_cache_stats["negativeHits"] += 1
+        return None
+    
+    user_cache_stats["misses"] += 1
+    user = await users_collection.find_one({"email": email})
+    if not user:
+        missing_user_cache[email] = True
+        return None
+    user_cache[email] = serialize_doc(user)
+    return dict(user)
+
 async def get_current_user(authorization: Optional[str] = Header(None)):
     if not authorization:
         return None
@@ -160,33 +1033,245 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
         if email is None:
             return None
         
-        user = await users_collection.find_one({"email": email})
-        return serialize_doc(user) if user else None
+        return await find_user(email)
     except JWTError:
         return None
 
+# Per-user data
+# Transactions, bills, UPI payments, custom categories, monthly rollups and AI
+# insights jobs belong to one user: each document holds the owner's userId
+# (the users _id as a string), every query filters on it and every index
+# starts with it, so a request only reads its own user's documents. The
+# default categories have no userId and are shared by everyone.
+USER_INDEXES = [
+    (transactions_collection, [("userId", 1), ("occurredAt", -1), ("_id", -1)]),
+    (transactions_collection, [("userId", 1), ("type", 1), ("occurredAt", -1), ("_id", -1)]),
+    (bills_collection, [("userId", 1), ("dueDate", 1)]),
+    (bills_collection, [("userId", 1), ("dueAt", 1)]),
+    (bills_collection, [("userId", 1), ("isRecurring", 1), ("parentBillId", 1)]),
+    (upi_payments_collection, [("userId", 1), ("date", -1)]),
+    (categories_collection, [("userId", 1)]),
+    (insights_jobs_collection, [("userId", 1), ("key", 1), ("status", 1)]),
+]
+# Earlier indexes that the ones above replace
+LEGACY_INDEXES = [
+    (transactions_collection, "type_1_occurredAt_1"),
+    (transactions_collection, "occurredAt_1"),
+    (transactions_collection, "date_-1__id_-1"),
+    (transactions_collection, "userId_1_date_-1__id_-1"),
+    (transactions_collection, "userId_1_occurredAt_1"),
+    (transactions_collection, "userId_1_type_1_occurredAt_1"),
+    (bills_collection, "dueAt_1"),
+    (insights_jobs_collection, "key_1_status_1"),
+    (rollups_collection, "month_1_type_1_category_1"),
+]
+
+# Shared by every user; categories users create get their userId
+DEFAULT_CATEGORIES = [
+    {"name": "Salary", "type": "income", "icon": "💰", "color": "#4CAF50"},
+    {"name": "Business", "type": "income", "icon": "💼", "color": "#2196F3"},
+    {"name": "Food", "type": "expense", "icon": "🍔", "color": "#FF9800"},
+    {"name": "Transport", "type": "expense", "icon": "🚗", "color": "#9C27B0"},
+    {"name": "Shopping", "type": "expense", "icon": "🛒", "color": "#E91E63"},
+    {"name": "Bills", "type": "expense", "icon": "📄", "color": "#F44336"},
+    {"name": "Entertainment", "type": "expense", "icon": "🎬", "color": "#673AB7"},
+    {"name": "Health", "type": "expense", "icon": "🏥", "color": "#00BCD4"},
+]
+
+async def current_user_id(current_user = Depends(get_current_user)):
+    """Dependency for per-user endpoints: the caller's userId, or a 401"""
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return str(current_user["_id"])
+
+async def create_user_indexes():
+    """Create the userId indexes and drop the global ones they replace.
+    
+    Returns True if the old global rollups index was dropped, i.e. the
+    rollups still need to be rebuilt per user.
+    """
+    for collection, keys in USER_INDEXES:
+        await collection.create_index(keys)
+    await rollups_collection.create_index(
+        [("userId", 1), ("month", 1), ("type", 1), ("category", 1)], unique=True
+    )
+    rebuild = False
+    for collection, name in LEGACY_INDEXES:
+        try:
+            await collection.drop_index(name)
+        except OperationFailure:
+            continue  # already dropped
+        rebuild = rebuild or collection is rollups_collection
+    return rebuild
+
+async def assign_unowned_data(email):
+    """Migration: give documents created before per-user data to one user"""
+    user = await users_collection.find_one({"email": email}, {"_id": 1})
+    if not user:
+        raise ValueError(f"No user with email {email}")
+    user_id = str(user["_id"])
+    await create_user_indexes()
+    unowned = {"userId": {"$exists": False}}
+    assigned = 0
+    for collection in (transactions_collection, bills_collection, upi_payments_collection):
+        assigned += (await collection.update_many(unowned, {"$set": {"userId": user_id}})).modified_count
+    # Custom categories too; the defaults stay shared
+    assigned += (await categories_collection.update_many(
+        {**unowned, "$nor": [{"name": c["name"], "type": c["type"]} for c in DEFAULT_CATEGORIES]},
+        {"$set": {"userId": user_id}}
+    )).modified_count
+    await rebuild_rollups()
+    return assigned
+
+async def ensure_ttl_index(collection, field, seconds):
+    """Create a TTL index, or change its expiry when the *_TTL_SECONDS setting changed"""
+    try:
+        await collection.create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict: same key, different expiry
+            raise
+        await collection.database.command({
+            "collMod": collection.name,
+            "index": {"keyPattern": {field: 1}, "expireAfterSeconds": seconds},
+        })
+
 @app.on_event("startup")
 async def startup_db_client():
+    await warm_up_mongo()
+    
     # Initialize default categories
     existing_categories = await categories_collection.count_documents({})
     if existing_categories == 0:
-        default_categories = [
-            {"name": "Salary", "type": "income", "icon": "💰", "color": "#4CAF50"},
-            {"name": "Business", "type": "income", "icon": "💼", "color": "#2196F3"},
-            {"name": "Food", "type": "expense", "icon": "🍔", "color": "#FF9800"},
-            {"name": "Transport", "type": "expense", "icon": "🚗", "color": "#9C27B0"},
-            {"name": "Shopping", "type": "expense", "icon": "🛒", "color": "#E91E63"},
-            {"name": "Bills", "type": "expense", "icon": "📄", "color": "#F44336"},
-            {"name": "Entertainment", "type": "expense", "icon": "🎬", "color": "#673AB7"},
-            {"name": "Health", "type": "expense", "icon": "🏥", "color": "#00BCD4"},
-        ]
-        await categories_collection.insert_many(default_categories)
+        await categories_collection.insert_many([dict(category) for category in DEFAULT_CATEGORIES])
+    
+    # Native date fields, and the per-user indexes behind list, sort and month
+    # range queries
+    await run_migration_once("migrate-dates", backfill_date_fields)
+    rollups_need_rebuild = await create_user_indexes()
+    await bills_collection.create_index([("parentBillId", 1), ("dueAt", 1)])
+    try:
+        await bills_collection.create_index(
+            [("parentBillId", 1), ("billMonth", 1)],
+            unique=True,
+            partialFilterExpression={"parentBillId": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        # Without it concurrent generators could insert duplicate instances
+        raise RuntimeError(
+            f"Could not create the unique recurring bill index; remove duplicate recurring bill instances first: {str(e)}"
+        ) from e
+    
+    # Monthly rollups for analytics. Rebuilding scans every transaction, so it
+    # is left to the rebuild-rollups command; startup only warns when they have
+    # never been built or were built before they were kept per user
+    if rollups_need_rebuild or (
+        await rollups_collection.estimated_document_count() == 0
+        and await transactions_collection.estimated_document_count() > 0
+    ):
+        print("Analytics rollups are missing or out of date; run `python server.py rebuild-rollups`")
+    
+    # AI insights cache entries and finished jobs expire on their own
+    await ensure_ttl_index(insights_cache_collection, "createdAt", AI_INSIGHTS_CACHE_TTL_SECONDS)
+    await ensure_ttl_index(insights_jobs_collection, "createdAt", 24 * 60 * 60)
+    await ensure_ttl_index(parse_cache_collection, "createdAt", PARSE_CACHE_TTL_SECONDS)
+    
+    # Background jobs; insights jobs queued in memory before a restart are lost
+    await fail_stale_insights_jobs()
+    app.state.scheduler_task = asyncio.create_task(recurring_bills_scheduler())
+    app.state.insights_workers = [
+        asyncio.create_task(insights_worker()) for _ in range(AI_INSIGHTS_WORKERS)
+    ]
+
+@app.on_event("shutdown")
+async def shutdown_db_client():
+    scheduler_task = getattr(app.state, "scheduler_task", None)
+    if scheduler_task:
+        scheduler_task.cancel()
+    for worker in getattr(app.state, "insights_workers", []):
+        worker.cancel()
 
 # Health check
 @app.get("/api/health")
 async def health_check():
     return {"status": "ok", "message": "Budget Planner API is running"}
 
+# Readiness probe: 200 once MongoDB answers a ping, 503 otherwise
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", 2))
+
+@app.get("/api/ready")
+async def readiness_check(response: Response):
+    pool = {
+        **pool_stats.snapshot(),
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE
+    }
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=READINESS_TIMEOUT_SECONDS)
+    except Exception as e:
+        response.status_code = 503
+        return {"status": "unavailable", "error": str(e) or type(e).__name__, "pool": pool}
+    return {"status": "ready", "pingMs": round((time.perf_counter() - start) * 1000, 1), "pool": pool}
+
+# Ops endpoints
+# /api/stats* and /metrics expose per-route traffic, pool state and cache
+# internals, so they require OPS_TOKEN as a bearer token (bearer_token in a
+# Prometheus scrape config). They return 404 while OPS_TOKEN is unset.
+OPS_TOKEN = os.getenv("OPS_TOKEN", "")
+
+async def require_ops_token(authorization: Optional[str] = Header(None)):
+    if not OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(authorization or "", f"Bearer {OPS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid ops token")
+
+# In-process counters for this worker
+@app.get("/api/stats", dependencies=[Depends(require_ops_token)])
+async def get_stats():
+    lookups = sum(user_cache_stats.values())
+    cached = user_cache_stats["hits"] + user_cache_stats["negativeHits"]
+    return {
+        "userCache": {
+            **user_cache_stats,
+            "size": len(user_cache),
+            "hitRate": round(cached / lookups, 3) if lookups else None
+        },
+        "passwordHashing": {**password_hash_stats, "workers": PASSWORD_HASH_WORKERS}
+    }
+
+class StatsCollector:
+    """Exports the /api/ready pool and /api/stats counters at scrape time"""
+    def collect(self):
+        pool = GaugeMetricFamily("mongo_pool", "MongoDB connection pool counters", labels=["counter"])
+        for key, value in pool_stats.snapshot().items():
+            pool.add_metric([key], value)
+        yield pool
+        users = GaugeMetricFamily("user_cache", "Authenticated user cache counters", labels=["counter"])
+        for key, value in {**user_cache_stats, "size": len(user_cache)}.items():
+            users.add_metric([key], value)
+        yield users
+        hashing = GaugeMetricFamily("password_hashing", "Password hashing counters", labels=["counter"])
+        for key, value in password_hash_stats.items():
+            hashing.add_metric([key], value)
+        yield hashing
+
+REGISTRY.register(StatsCollector())
+
+@app.get("/api/stats/slow-queries", dependencies=[Depends(require_ops_token)])
+async def get_slow_queries(limit: int = Query(50, ge=1, le=SLOW_QUERY_LOG_SIZE)):
+    # A snapshot: explains still in flight are counted, not waited for
+    return {
+        "thresholdMs": SLOW_QUERY_MS,
+        "explainSampleRate": EXPLAIN_SAMPLE_RATE,
+        **query_plan_stats,
+        "pendingExplains": len(explain_tasks),
+        "queries": list(slow_query_log)[-limit:][::-1]
+    }
+
+@app.get("/metrics", dependencies=[Depends(require_ops_token)])
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 # Authentication endpoints
 @app.post("/api/auth/register", response_model=Token)
 async def register(user: UserRegister):
@@ -196,7 +1281,7 @@ async def register(user: UserRegister):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Hash password and create user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_data = {
         "email": user.email,
         "password": hashed_password,
@@ -205,6 +1290,7 @@ async def register(user: UserRegister):
     }
     
     result = await users_collection.insert_one(user_data)
+    invalidate_user(user.email)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -218,7 +1304,7 @@ async def register(user: UserRegister):
 async def login(user: UserLogin):
     # Find user
     db_user = await users_collection.find_one({"email": user.email})
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    if not db_user or not await verify_password(user.password, db_user["password"]):
         raise HTTPException(
             status_code=401,
             detail="Incorrect email or password"
@@ -245,16 +1331,18 @@ async def reset_password(
     if not current_user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    # Verify current password
-    if not verify_password(password_data.currentPassword, current_user["password"]):
+    # Verify current password against the stored hash, not a cached copy
+    db_user = await users_collection.find_one({"email": current_user["email"]})
+    if not db_user or not await verify_password(password_data.currentPassword, db_user["password"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Update password
-    new_hashed_password = get_password_hash(password_data.newPassword)
+    new_hashed_password = await get_password_hash(password_data.newPassword)
     await users_collection.update_one(
         {"email": current_user["email"]},
         {"$set": {"password": new_hashed_password}}
     )
+    invalidate_user(current_user["email"])
     
     return {"message": "Password updated successfully"}
 
@@ -300,12 +1388,13 @@ async def social_login(social_data: SocialLogin):
         user_data = {
             "email": social_data.email,
             "name": social_data.name,
-            "password": get_password_hash(f"{social_data.provider}_{social_data.token[:20]}"),  # Dummy password
+            "password": await get_password_hash(f"{social_data.provider}_{social_data.token[:20]}"),  # Dummy password
             "socialProvider": social_data.provider,
             "createdAt": datetime.utcnow().isoformat()
         }
         
         result = await users_collection.insert_one(user_data)
+        invalidate_user(social_data.email)
         
         # Create access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -317,87 +1406,455 @@ async def social_login(social_data: SocialLogin):
 
 # Categories
 @app.get("/api/categories")
-async def get_categories():
-    categories = await categories_collection.find().to_list(length=100)
-    return {"categories": [serialize_doc(cat) for cat in categories]}
+async def get_categories(fields: Optional[str] = None, user_id: str = Depends(current_user_id)):
+    projection = fields_projection(fields, CATEGORY_FIELDS)
+    # The shared default categories plus the user's own
+    categories = await categories_collection.find(
+        {"userId": {"$in": [None, user_id]}}, projection
+    ).to_list(length=100)
+    return MongoJSONResponse({"categories": categories})
 
 @app.post("/api/categories")
-async def create_category(category: Category):
-    result = await categories_collection.insert_one(category.dict())
-    new_category = await categories_collection.find_one({"_id": result.inserted_id})
-    return {"category": serialize_doc(new_category)}
+async def create_category(category: Category, user_id: str = Depends(current_user_id)):
+    doc = {**category.dict(), "userId": user_id}
+    await categories_collection.insert_one(doc)  # sets doc["_id"]
+    return {"category": serialize_doc(await written_doc(categories_collection, doc, CATEGORY_FIELDS))}
 
 # Transactions
-@app.get("/api/transactions")
-async def get_transactions(type: Optional[str] = None, month: Optional[str] = None):
-    query = {}
+def transactions_query(user_id, type=None, month=None):
+    query = {"userId": user_id}
     if type:
         query["type"] = type
     if month:
         # Filter by month (YYYY-MM format)
-        query["date"] = {"$regex": f"^{month}"}
+        query["occurredAt"] = month_range(month)
+    return query
+
+@app.get("/api/transactions")
+async def get_transactions(
+    type: Optional[str] = None,
+    month: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
+    fields: Optional[str] = None,
+    user_id: str = Depends(current_user_id)
+):
+    """List transactions newest first.
+    
+    Pages are limited to `limit` items; pass the returned `nextCursor` back as
+    `cursor` to get the next page. With format=ndjson every matching
+    transaction is streamed one JSON object per line instead.
+    """
+    projection = fields_projection(fields, TRANSACTION_FIELDS)
+    query = transactions_query(user_id, type, month)
+    if cursor:
+        query = {"$and": [query, cursor_query(cursor)]}
+    
+    sort = [("occurredAt", -1), ("_id", -1)]
+    
+    if format == "ndjson":
+        async def stream():
+            async for t in transactions_collection.find(query, projection).sort(sort):
+                yield orjson.dumps(t, default=json_default) + b"\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    # occurredAt is the sort key, needed to build nextCursor but not returned
+    transactions = await transactions_collection.find(query, {**projection, "occurredAt": 1}).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(transactions[limit - 1]) if len(transactions) > limit else None
+    for t in transactions:
+        t.pop("occurredAt", None)
+    return MongoJSONResponse({
+        "transactions": transactions[:limit],
+        "nextCursor": next_cursor
+    })
+
+# Transaction import/export
+# Statements are imported as CSV (a header row naming Transaction fields) or
+# NDJSON, parsed while the body streams in and inserted IMPORT_BATCH_SIZE rows
+# at a time. The export writes the same columns, so the two round-trip. These
+# routes must stay above /api/transactions/{transaction_id}.
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+EXPORT_FIELDS = ("type", "amount", "category", "description", "date", "createdAt")
+IMPORT_COLUMNS = {field.lower(): field for field in EXPORT_FIELDS}
+
+async def iter_lines(stream):
+    """Decode a byte stream into lines without holding the whole body"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def iter_csv_rows(lines):
+    """Yield (row number, row dict) per CSV record; quoted fields may span lines"""
+    header = None
+    record, quotes, row_number = [], 0, 0
+    async for line in lines:
+        record.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue  # inside a quoted field
+        values = next(csv.reader(["\n".join(record)]))
+        record, quotes = [], 0
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [IMPORT_COLUMNS.get(value.strip().lower()) for value in values]
+            continue
+        row_number += 1
+        # Empty cells fall back to the model defaults
+        yield row_number, {name: value for name, value in zip(header, values) if name and value != ""}
+
+async def iter_ndjson_rows(lines):
+    """Yield (row number, raw line) per non-empty NDJSON line"""
+    row_number = 0
+    async for line in lines:
+        if line.strip():
+            row_number += 1
+            yield row_number, line
+
+def row_error(e):
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+    return str(e)
+
+@app.post("/api/transactions/import")
+async def import_transactions(request: Request, format: str = "csv", user_id: str = Depends(current_user_id)):
+    """Bulk-import transactions from a CSV or NDJSON request body.
+    
+    Invalid rows (including dates that aren't YYYY-MM-DD and undecodable
+    images) are skipped and reported, up to IMPORT_MAX_ERRORS of them, with
+    their 1-based row number; valid rows are imported.
+    """
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    
+    lines = iter_lines(request.stream())
+    rows = iter_csv_rows(lines) if format == "csv" else iter_ndjson_rows(lines)
+    batch = []  # (row number, document)
+    imported = failed = 0
+    errors = []
+    
+    def fail(row_number, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"row": row_number, "error": error})
+    
+    async def flush():
+        nonlocal imported
+        if not batch:
+            return
+        docs = [doc for _, doc in batch]
+        inserted = list(range(len(batch)))
+        try:
+            await transactions_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed_indexes = set()
+            for error in e.details["writeErrors"]:
+                failed_indexes.add(error["index"])
+                fail(batch[error["index"]][0], error["errmsg"])
+            inserted = [i for i in inserted if i not in failed_indexes]
+        await add_many_to_rollups([docs[i] for i in inserted])
+        imported += len(inserted)
+        batch.clear()
+    
+    async for row_number, row in rows:
+        try:
+            if isinstance(row, str):
+                row = json.loads(row)
+            transaction = Transaction(**row)
+        except (ValueError, TypeError) as e:
+            fail(row_number, row_error(e))
+            continue
+        if not is_iso_date(transaction.date):
+            fail(row_number, "date: expected YYYY-MM-DD")
+            continue
+        try:
+            doc = await store_transaction_image(transaction_doc(transaction, user_id), transaction)
+        except HTTPException as e:
+            fail(row_number, e.detail)
+            continue
+        batch.append((row_number, doc))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush()
+    await flush()
     
-    transactions = await transactions_collection.find(query).sort("date", -1).to_list(length=1000)
-    return {"transactions": [serialize_doc(t) for t in transactions]}
+    return {"imported": imported, "failed": failed, "errors": errors}
+
+@app.get("/api/transactions/export")
+async def export_transactions(
+    format: str = "csv",
+    type: Optional[str] = None,
+    month: Optional[str] = None,
+    user_id: str = Depends(current_user_id)
+):
+    """Stream transactions, oldest first, in the format import_transactions reads"""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    
+    cursor = transactions_collection.find(
+        transactions_query(user_id, type, month),
+        {**dict.fromkeys(EXPORT_FIELDS, 1), "_id": 0}
+    ).sort([("occurredAt", 1), ("_id", 1)]).batch_size(IMPORT_BATCH_SIZE)
+    
+    if format == "ndjson":
+        async def stream():
+            async for t in cursor:
+                yield orjson.dumps(t, default=json_default) + b"\n"
+        media_type = "application/x-ndjson"
+    else:
+        async def stream():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_FIELDS)
+            count = 0
+            async for t in cursor:
+                writer.writerow([t.get(field, "") for field in EXPORT_FIELDS])
+                count += 1
+                if count % IMPORT_BATCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        media_type = "text/csv"
+    
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'}
+    )
 
 @app.get("/api/transactions/{transaction_id}")
-async def get_transaction(transaction_id: str):
+async def get_transaction(transaction_id: str, user_id: str = Depends(current_user_id)):
     try:
-        transaction = await transactions_collection.find_one({"_id": ObjectId(transaction_id)})
+        transaction = await transactions_collection.find_one(
+            {"_id": ObjectId(transaction_id), "userId": user_id}, dict.fromkeys(TRANSACTION_FIELDS, 1)
+        )
         if not transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
         return {"transaction": serialize_doc(transaction)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/transactions/{transaction_id}/image")
+async def get_transaction_image(transaction_id: str, user_id: str = Depends(current_user_id)):
+    """Stream the receipt photo attached to a transaction"""
+    try:
+        transaction_oid = ObjectId(transaction_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid transaction id")
+    transaction = await transactions_collection.find_one(
+        {"_id": transaction_oid, "userId": user_id},
+        {"imageId": 1, "imageContentType": 1, "imageBase64": 1}
+    )
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    
+    if transaction.get("imageId"):
+        chunks = await open_receipt_image(transaction["imageId"])
+        if chunks:
+            return StreamingResponse(
+                chunks,
+                media_type=transaction.get("imageContentType", "image/jpeg"),
+                headers={"Cache-Control": "private, max-age=86400"}
+            )
+    elif transaction.get("imageBase64"):
+        # Not moved to the receipt store yet (python server.py migrate-images)
+        data, content_type = decode_image(transaction["imageBase64"])
+        return Response(data, media_type=content_type)
+    raise HTTPException(status_code=404, detail="Transaction has no image")
+
 @app.post("/api/transactions")
-async def create_transaction(transaction: Transaction):
-    result = await transactions_collection.insert_one(transaction.dict())
-    new_transaction = await transactions_collection.find_one({"_id": result.inserted_id})
-    return {"transaction": serialize_doc(new_transaction)}
+async def create_transaction(transaction: Transaction, user_id: str = Depends(current_user_id)):
+    doc = await store_transaction_image(transaction_doc(transaction, user_id), transaction)
+    await transactions_collection.insert_one(doc)  # sets doc["_id"]
+    await apply_to_rollups(doc)
+    return {"transaction": serialize_doc(await written_doc(transactions_collection, doc, TRANSACTION_FIELDS))}
 
 @app.put("/api/transactions/{transaction_id}")
-async def update_transaction(transaction_id: str, transaction: Transaction):
+async def update_transaction(transaction_id: str, transaction: Transaction, user_id: str = Depends(current_user_id)):
+    # Validate the id before a new image is stored for it
     try:
-        result = await transactions_collection.update_one(
-            {"_id": ObjectId(transaction_id)},
-            {"$set": transaction.dict()}
-        )
-        if result.matched_count == 0:
+        transaction_oid = ObjectId(transaction_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid transaction id")
+    try:
+        # Without a new imageBase64 the current image is kept
+        doc = await store_transaction_image(transaction_doc(transaction, user_id), transaction)
+        update = {"$set": doc}
+        if "imageId" in doc:
+            update["$unset"] = {"imageBase64": ""}
+        old_transaction = None
+        try:
+            old_transaction = await transactions_collection.find_one_and_update(
+                {"_id": transaction_oid, "userId": user_id},
+                update,
+                projection=WITHOUT_IMAGE,
+                return_document=ReturnDocument.BEFORE
+            )
+        finally:
+            # Nothing references the new image unless the update went through
+            if not old_transaction and "imageId" in doc:
+                await delete_receipt_image(doc["imageId"])
+        if not old_transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
-        updated_transaction = await transactions_collection.find_one({"_id": ObjectId(transaction_id)})
+        if "imageId" in doc and old_transaction.get("imageId"):
+            await delete_receipt_image(old_transaction["imageId"])
+        await apply_to_rollups(old_transaction, sign=-1)
+        await apply_to_rollups(doc)
+        updated_transaction = await written_doc(
+            transactions_collection, {**old_transaction, **doc}, TRANSACTION_FIELDS
+        )
         return {"transaction": serialize_doc(updated_transaction)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/api/transactions/{transaction_id}")
-async def delete_transaction(transaction_id: str):
+async def delete_transaction(transaction_id: str, user_id: str = Depends(current_user_id)):
     try:
-        result = await transactions_collection.delete_one({"_id": ObjectId(transaction_id)})
-        if result.deleted_count == 0:
+        deleted_transaction = await transactions_collection.find_one_and_delete(
+            {"_id": ObjectId(transaction_id), "userId": user_id}, projection=WITHOUT_IMAGE
+        )
+        if not deleted_transaction:
             raise HTTPException(status_code=404, detail="Transaction not found")
+        await apply_to_rollups(deleted_transaction, sign=-1)
+        if deleted_transaction.get("imageId"):
+            await delete_receipt_image(deleted_transaction["imageId"])
         return {"message": "Transaction deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# LLM
+# All LLM calls go through new_chat(). With LLM_PROVIDER=fake it returns an
+# offline stand-in with canned responses, so the parsing and insights
+# pipelines can run without an API key or network access.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "emergent")
+LLM_MODEL = "gpt-4o-mini"
+FAKE_LLM_DELAY_SECONDS = float(os.getenv("FAKE_LLM_DELAY_SECONDS", 0))
+
+class FakeLlmChat:
+    RESPONSES = {
+        "receipt": "Amount: 0\nMerchant: Unknown\nDate: 1970-01-01\nCategory: Other",
+        "sms": "NOT_TRANSACTION",
+        # One "[n] NOT_TRANSACTION" line per numbered SMS in the prompt
+        "sms-batch": lambda text: "\n".join(
+            f"[{n}] NOT_TRANSACTION" for n in re.findall(r'^\[(\d+)\] ', text, re.MULTILINE)
+        ),
+        "email": "NOT_BILL",
+        "ai-insights": json.dumps({
+            "loan_payoff_strategy": {
+                "current_timeline": "N/A",
+                "accelerated_timeline": "N/A",
+                "recommendation": "Offline insights"
+            },
+            "savings_opportunities": [],
+            "spending_insights": ["Offline insights"],
+            "financial_health_score": 70,
+            "top_recommendations": ["Continue tracking expenses"],
+            "future_projection": {"6_months": "N/A", "1_year": "N/A"}
+        }),
+    }
+    
+    def __init__(self, kind):
+        self.kind = kind
+    
+    async def send_message(self, message):
+        await asyncio.sleep(FAKE_LLM_DELAY_SECONDS)
+        response = self.RESPONSES[self.kind]
+        return response(message.text) if callable(response) else response
+
+def llm_configured():
+    return LLM_PROVIDER == "fake" or bool(os.getenv("EMERGENT_LLM_KEY"))
+
+def new_chat(kind, system_message):
+    if LLM_PROVIDER == "fake":
+        return TimedChat(FakeLlmChat(kind), kind)
+    return TimedChat(LlmChat(
+        api_key=os.getenv("EMERGENT_LLM_KEY"),
+        session_id=f"{kind}-{datetime.utcnow().timestamp()}",
+        system_message=system_message
+    ).with_model("openai", LLM_MODEL), kind)
+
+# Parse result cache
+# SMS and email parse results are content-addressed: the key hashes the LLM
+# provider, model, prompt version and the normalised message, so re-syncing
+# an inbox never sends the same message to the LLM twice. Bump the prompt
+# version whenever a prompt changes; old entries are then never read again
+# and the TTL index removes them. Lookups hit an in-process TTL/LRU cache
+# first and the parse_cache collection second.
+SMS_PROMPT_VERSION = "1"
+EMAIL_PROMPT_VERSION = "1"
+PARSE_CACHE_TTL_SECONDS = int(os.getenv("PARSE_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60))
+parse_cache = TTLCache(maxsize=int(os.getenv("PARSE_CACHE_SIZE", 10000)), ttl=PARSE_CACHE_TTL_SECONDS)
+
+def parse_cache_key(kind, prompt_version, *parts):
+    normalized = [" ".join(part.lower().split()) for part in parts]
+    payload = json.dumps([LLM_PROVIDER, LLM_MODEL, kind, prompt_version, *normalized])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def sms_cache_key(sms):
+    return parse_cache_key("sms", SMS_PROMPT_VERSION, sms.date, sms.body)
+
+def email_cache_key(email):
+    # Only the first 500 characters of the body reach the prompt
+    return parse_cache_key("email", EMAIL_PROMPT_VERSION, email.subject, email.body[:500])
+
+async def get_cached_parses(keys):
+    """Return {key: result} for the keys that are in the parse cache"""
+    found = {key: parse_cache[key] for key in keys if key in parse_cache}
+    missing = [key for key in set(keys) if key not in found]
+    if missing:
+        expires_before = datetime.utcnow() - timedelta(seconds=PARSE_CACHE_TTL_SECONDS)
+        async for doc in parse_cache_collection.find({"_id": {"$in": missing}, "createdAt": {"$gt": expires_before}}):
+            parse_cache[doc["_id"]] = found[doc["_id"]] = doc["result"]
+    return found
+
+async def store_parses(results):
+    """Cache {key: result} pairs"""
+    if not results:
+        return
+    now = datetime.utcnow()
+    operations = []
+    for key, result in results.items():
+        parse_cache[key] = result
+        operations.append(UpdateOne({"_id": key}, {"$set": {"result": result, "createdAt": now}}, upsert=True))
+    await parse_cache_collection.bulk_write(operations, ordered=False)
+
 # Receipt OCR
+RECEIPT_MAX_EDGE = int(os.getenv("RECEIPT_MAX_EDGE", 1600))
+
 @app.post("/api/ocr/receipt")
-async def scan_receipt(receipt: ReceiptOCR):
+async def scan_receipt(receipt: ReceiptOCR, preprocess: bool = True):
     try:
         # Use Emergent LLM for OCR
-        api_key = os.getenv("EMERGENT_LLM_KEY")
-        if not api_key:
+        if not llm_configured():
             raise HTTPException(status_code=500, detail="API key not configured")
         
+        # Downsample, grayscale and crop the photo off the event loop; the
+        # model reads a 1600px grayscale receipt as well as a 12MP colour photo
+        image_base64 = receipt.imageBase64
+        metadata = {"preprocessed": False, "originalBytes": len(image_base64)}
+        if preprocess:
+            image_base64, metadata = await asyncio.to_thread(
+                preprocess_receipt, image_base64, RECEIPT_MAX_EDGE
+            )
+        
         # Create chat instance
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"receipt-{datetime.utcnow().timestamp()}",
-            system_message="You are a receipt OCR assistant. Extract transaction details from receipt images."
-        ).with_model("openai", "gpt-4o-mini")
+        chat = new_chat(
+            "receipt",
+            "You are a receipt OCR assistant. Extract transaction details from receipt images."
+        )
         
         # Create image content
-        image_content = ImageContent(image_base64=receipt.imageBase64)
+        image_content = ImageContent(image_base64=image_base64)
         
         # Create message
         user_message = UserMessage(
@@ -416,7 +1873,9 @@ async def scan_receipt(receipt: ReceiptOCR):
         )
         
         # Get response
+        start = time.perf_counter()
         response = await chat.send_message(user_message)
+        metadata["ocrMs"] = round((time.perf_counter() - start) * 1000, 1)
         
         # Parse response
         amount_match = re.search(r'Amount:\s*([\d.]+)', response)
@@ -428,72 +1887,199 @@ async def scan_receipt(receipt: ReceiptOCR):
             "amount": float(amount_match.group(1)) if amount_match else 0.0,
             "merchant": merchant_match.group(1).strip() if merchant_match else "Unknown",
             "date": date_match.group(1) if date_match else datetime.utcnow().strftime("%Y-%m-%d"),
-            "category": category_match.group(1).strip() if category_match else "Other"
+            "category": category_match.group(1).strip() if category_match else "Other",
+            "preprocessing": metadata
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR failed: {str(e)}")
 
 # SMS Parsing
-@app.post("/api/parse/sms")
-async def parse_sms(sms: SMSMessage):
-    try:
-        # Use AI to parse SMS
-        api_key = os.getenv("EMERGENT_LLM_KEY")
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"sms-{datetime.utcnow().timestamp()}",
-            system_message="You are an SMS parser for banking transactions."
-        ).with_model("openai", "gpt-4o-mini")
-        
-        user_message = UserMessage(
-            text=f"""Parse this SMS and identify if it's a banking transaction (credit/debit):
-            SMS: {sms.body}
-            
-            If it's a transaction, respond in this format:
-            Type: [debit/credit]
+SMS_RESPONSE_FORMAT = """Type: [debit/credit]
             Amount: [number]
             Merchant: [name or N/A]
             Date: [YYYY-MM-DD]
-            IsUPI: [yes/no]
+            IsUPI: [yes/no]"""
+
+def parse_sms_response(response, sms):
+    """Turn the LLM's reply for one SMS into the parse_sms response"""
+    if "NOT_TRANSACTION" in response:
+        return {"isTransaction": False}
+    
+    type_match = re.search(r'Type:\s*(debit|credit)', response, re.IGNORECASE)
+    amount_match = re.search(r'Amount:\s*([\d.]+)', response)
+    merchant_match = re.search(r'Merchant:\s*(.+?)(?:\n|$)', response)
+    date_match = re.search(r'Date:\s*(\d{4}-\d{2}-\d{2})', response)
+    is_upi_match = re.search(r'IsUPI:\s*(yes|no)', response, re.IGNORECASE)
+    
+    return {
+        "isTransaction": True,
+        "type": "expense" if type_match and type_match.group(1).lower() == "debit" else "income",
+        "amount": float(amount_match.group(1)) if amount_match else 0.0,
+        "merchant": merchant_match.group(1).strip() if merchant_match else "Unknown",
+        "date": date_match.group(1) if date_match else sms.date,
+        "isUPI": bool(is_upi_match) and is_upi_match.group(1).lower() == "yes",
+        "category": "Bills"
+    }
+
+async def parse_sms_with_llm(sms):
+    chat = new_chat("sms", "You are an SMS parser for banking transactions.")
+    
+    user_message = UserMessage(
+        text=f"""Parse this SMS and identify if it's a banking transaction (credit/debit):
+            SMS: {sms.body}
+            
+            If it's a transaction, respond in this format:
+            {SMS_RESPONSE_FORMAT}
             
             If it's not a banking transaction, respond with: NOT_TRANSACTION"""
-        )
-        
-        response = await chat.send_message(user_message)
-        
-        if "NOT_TRANSACTION" in response:
-            return {"isTransaction": False}
+    )
+    
+    response = await chat.send_message(user_message)
+    return parse_sms_response(response, sms)
+
+@app.post("/api/parse/sms")
+async def parse_sms(sms: SMSMessage):
+    try:
+        # Common bank/UPI templates and obvious non-transactions are handled
+        # by the rule-based parser; only messages it isn't sure about reach the LLM
+        parsed = parse_sms_with_rules(sms.body, sms.date)
+        if parsed is not None:
+            return parsed
         
-        # Parse response
-        type_match = re.search(r'Type:\s*(debit|credit)', response, re.IGNORECASE)
-        amount_match = re.search(r'Amount:\s*([\d.]+)', response)
-        merchant_match = re.search(r'Merchant:\s*(.+?)(?:\n|$)', response)
-        date_match = re.search(r'Date:\s*(\d{4}-\d{2}-\d{2})', response)
-        is_upi_match = re.search(r'IsUPI:\s*(yes|no)', response, re.IGNORECASE)
+        key = sms_cache_key(sms)
+        cached = await get_cached_parses([key])
+        if key in cached:
+            return cached[key]
         
-        return {
-            "isTransaction": True,
-            "type": "expense" if type_match and type_match.group(1).lower() == "debit" else "income",
-            "amount": float(amount_match.group(1)) if amount_match else 0.0,
-            "merchant": merchant_match.group(1).strip() if merchant_match else "Unknown",
-            "date": date_match.group(1) if date_match else sms.date,
-            "isUPI": is_upi_match and is_upi_match.group(1).lower() == "yes",
-            "category": "Bills"
-        }
+        parsed = await parse_sms_with_llm(sms)
+        await store_parses({key: parsed})
+        return parsed
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"SMS parsing failed: {str(e)}")
 
+# Batch SMS parsing
+# Messages the rules can't handle are packed SMS_BATCH_PROMPT_SIZE to a prompt,
+# and at most SMS_BATCH_CONCURRENCY prompts are in flight across all requests.
+SMS_BATCH_MAX_MESSAGES = int(os.getenv("SMS_BATCH_MAX_MESSAGES", 5000))
+SMS_BATCH_PROMPT_SIZE = int(os.getenv("SMS_BATCH_PROMPT_SIZE", 10))
+SMS_BATCH_CONCURRENCY = int(os.getenv("SMS_BATCH_CONCURRENCY", 4))
+sms_batch_semaphore = asyncio.Semaphore(SMS_BATCH_CONCURRENCY)
+SMS_BLOCK = re.compile(r'^\s*\[(\d+)\](.*?)(?=^\s*\[\d+\]|\Z)', re.MULTILINE | re.DOTALL)
+
+class SMSBatch(BaseModel):
+    messages: List[SMSMessage] = Field(..., max_length=SMS_BATCH_MAX_MESSAGES)
+
+def sms_fingerprint(sms):
+    """Content hash that ignores case, whitespace and punctuation, so
+    re-delivered or re-forwarded copies of a message collapse together"""
+    normalized = re.sub(r'\W+', ' ', sms.body.lower()).strip()
+    return hashlib.sha256(f"{sms.date}|{normalized}".encode()).hexdigest()
+
+async def parse_sms_pack(pack):
+    """Parse several SMS with a single LLM prompt, in order.
+    
+    Messages missing from the reply are retried one at a time.
+    """
+    if len(pack) == 1:
+        return [await parse_sms_with_llm(pack[0])]
+    
+    chat = new_chat("sms-batch", "You are an SMS parser for banking transactions.")
+    numbered = "\n".join(f"[{i}] {sms.body}" for i, sms in enumerate(pack, 1))
+    
+    user_message = UserMessage(
+        text=f"""Parse each numbered SMS below and identify if it's a banking transaction (credit/debit):
+{numbered}
+            
+            Answer every SMS in order, starting each answer with its number in brackets on its own line.
+            If it's a transaction, respond in this format:
+            [number]
+            {SMS_RESPONSE_FORMAT}
+            
+            If it's not a banking transaction, respond with: [number] NOT_TRANSACTION"""
+    )
+    
+    response = await chat.send_message(user_message)
+    blocks = {int(m.group(1)): m.group(2) for m in SMS_BLOCK.finditer(response)}
+    
+    results = []
+    for i, sms in enumerate(pack, 1):
+        if i in blocks:
+            results.append(parse_sms_response(blocks[i], sms))
+        else:
+            results.append(await parse_sms_with_llm(sms))
+    return results
+
+@app.post("/api/parse/sms/batch")
+async def parse_sms_batch(batch: SMSBatch):
+    """Parse many SMS at once. Results come back in request order; duplicates
+    get the first copy's result plus duplicateOf, the index of that copy."""
+    messages = batch.messages
+    fingerprints = [sms_fingerprint(sms) for sms in messages]
+    results = [None] * len(messages)
+    first_index = {}
+    pending = []
+    
+    for i, (sms, fingerprint) in enumerate(zip(messages, fingerprints)):
+        if fingerprint in first_index:
+            continue
+        first_index[fingerprint] = i
+        parsed = parse_sms_with_rules(sms.body, sms.date)
+        if parsed is not None:
+            results[i] = parsed
+        else:
+            pending.append(i)
+    
+    # Messages parsed by an earlier sync come from the parse cache
+    cache_keys = {i: sms_cache_key(messages[i]) for i in pending}
+    cached = await get_cached_parses(list(cache_keys.values()))
+    for i in pending:
+        if cache_keys[i] in cached:
+            results[i] = cached[cache_keys[i]]
+    from_cache = len(pending)
+    pending = [i for i in pending if results[i] is None]
+    from_cache -= len(pending)
+    
+    async def parse_pack(indexes):
+        async with sms_batch_semaphore:
+            try:
+                parsed = await parse_sms_pack([messages[i] for i in indexes])
+            except Exception as e:
+                parsed = [{"error": f"SMS parsing failed: {str(e)}"}] * len(indexes)
+        for i, result in zip(indexes, parsed):
+            results[i] = result
+    
+    await asyncio.gather(*[
+        parse_pack(pending[i:i + SMS_BATCH_PROMPT_SIZE])
+        for i in range(0, len(pending), SMS_BATCH_PROMPT_SIZE)
+    ])
+    await store_parses({
+        cache_keys[i]: results[i] for i in pending if "error" not in results[i]
+    })
+    
+    for i, fingerprint in enumerate(fingerprints):
+        first = first_index[fingerprint]
+        if first != i:
+            results[i] = {**results[first], "duplicateOf": first}
+    
+    return {
+        "results": results,
+        "total": len(messages),
+        "unique": len(first_index),
+        "fromCache": from_cache,
+        "parsedWithLlm": len(pending)
+    }
+
 # Email Parsing
 @app.post("/api/parse/email")
 async def parse_email(email: EmailMessage):
     try:
+        key = email_cache_key(email)
+        cached = await get_cached_parses([key])
+        if key in cached:
+            return cached[key]
+        
         # Use AI to parse email for credit card bills
-        api_key = os.getenv("EMERGENT_LLM_KEY")
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"email-{datetime.utcnow().timestamp()}",
-            system_message="You are an email parser for credit card bills."
-        ).with_model("openai", "gpt-4o-mini")
+        chat = new_chat("email", "You are an email parser for credit card bills.")
         
         user_message = UserMessage(
             text=f"""Parse this email and identify if it's a credit card bill:
@@ -510,68 +2096,176 @@ async def parse_email(email: EmailMessage):
         
         response = await chat.send_message(user_message)
         
+        # A guessed due date is relative to today, so don't cache it
+        cacheable = True
         if "NOT_BILL" in response:
-            return {"isBill": False}
-        
-        # Parse response
-        bill_name_match = re.search(r'BillName:\s*(.+?)(?:\n|$)', response)
-        amount_match = re.search(r'Amount:\s*([\d.]+)', response)
-        due_date_match = re.search(r'DueDate:\s*(\d{4}-\d{2}-\d{2})', response)
+            parsed = {"isBill": False}
+        else:
+            # Parse response
+            bill_name_match = re.search(r'BillName:\s*(.+?)(?:\n|$)', response)
+            amount_match = re.search(r'Amount:\s*([\d.]+)', response)
+            due_date_match = re.search(r'DueDate:\s*(\d{4}-\d{2}-\d{2})', response)
+            
+            parsed = {
+                "isBill": True,
+                "billName": bill_name_match.group(1).strip() if bill_name_match else "Credit Card Bill",
+                "amount": float(amount_match.group(1)) if amount_match else 0.0,
+                "dueDate": due_date_match.group(1) if due_date_match else (datetime.utcnow() + timedelta(days=7)).strftime("%Y-%m-%d")
+            }
+            cacheable = bool(due_date_match)
         
-        return {
-            "isBill": True,
-            "billName": bill_name_match.group(1).strip() if bill_name_match else "Credit Card Bill",
-            "amount": float(amount_match.group(1)) if amount_match else 0.0,
-            "dueDate": due_date_match.group(1) if due_date_match else (datetime.utcnow() + timedelta(days=7)).strftime("%Y-%m-%d")
-        }
+        if cacheable:
+            await store_parses({key: parsed})
+        return parsed
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Email parsing failed: {str(e)}")
 
 # Helper function to generate recurring bills
-async def generate_recurring_bills():
-    """Auto-generate recurring bills for the current month"""
-    try:
-        # Find all recurring bills (parent bills)
-        recurring_bills = await bills_collection.find({"isRecurring": True, "parentBillId": None}).to_list(length=1000)
+async def generate_recurring_bills(month=None, parent_ids=None):
+    """Auto-generate recurring bills for a month (default: current month).
+    
+    Pass parent_ids to only generate instances for those recurring bills.
+    Errors are raised, so the scheduler only records the month as done once
+    every instance exists.
+    """
+    # Find all recurring bills (parent bills)
+    query = {"isRecurring": True, "parentBillId": None}
+    if parent_ids is not None:
+        query["_id"] = {"$in": parent_ids}
+    recurring_bills = await bills_collection.find(query).to_list(length=None)
+    if not recurring_bills:
+        return
+    
+    current_month = month or datetime.utcnow().strftime("%Y-%m")
+    
+    # One lookup for the instances that already exist this month
+    existing = await bills_collection.find(
+        {
+            "parentBillId": {"$in": [str(b["_id"]) for b in recurring_bills]},
+            "billMonth": current_month
+        },
+        {"parentBillId": 1}
+    ).to_list(length=None)
+    existing_parents = {b["parentBillId"] for b in existing}
+    
+    operations = []
+    for parent_bill in recurring_bills:
+        parent_id = str(parent_bill["_id"])
+        if parent_id in existing_parents:
+            continue
         
-        current_month = datetime.utcnow().strftime("%Y-%m")
+        # Generate new bill for this month
+        # Day 31 falls on the last day of shorter months
+        recurring_day = min(parent_bill.get("recurringDay") or 1, days_in_month(parse_date(current_month)))
+        due_date = f"{current_month}-{recurring_day:02d}"
         
-        for parent_bill in recurring_bills:
-            # Check if bill for this month already exists
-            existing_bill = await bills_collection.find_one({
-                "parentBillId": str(parent_bill["_id"]),
-                "dueDate": {"$regex": f"^{current_month}"}
-            })
-            
-            if not existing_bill:
-                # Generate new bill for this month
-                recurring_day = parent_bill.get("recurringDay", 1)
-                due_date = f"{current_month}-{recurring_day:02d}"
-                
-                new_bill = {
-                    "name": parent_bill["name"],
-                    "amount": parent_bill["amount"],
-                    "dueDate": due_date,
-                    "isPaid": False,
-                    "category": parent_bill["category"],
-                    "reminderSet": False,
-                    "source": "recurring",
-                    "isRecurring": False,
-                    "recurringDay": None,
-                    "parentBillId": str(parent_bill["_id"]),
-                    "createdAt": datetime.utcnow().isoformat()
-                }
-                await bills_collection.insert_one(new_bill)
+        new_bill = {
+            "userId": parent_bill.get("userId"),
+            "name": parent_bill["name"],
+            "amount": parent_bill["amount"],
+            "dueDate": due_date,
+            "isPaid": False,
+            "category": parent_bill["category"],
+            "reminderSet": False,
+            "source": "recurring",
+            "isRecurring": False,
+            "recurringDay": None,
+            "createdAt": datetime.utcnow().isoformat(),
+            "dueAt": parse_date(due_date)
+        }
+        # Upsert keyed on (parentBillId, billMonth) so concurrent requests
+        # can't create the same instance twice
+        operations.append(UpdateOne(
+            {"parentBillId": parent_id, "billMonth": current_month},
+            {"$setOnInsert": new_bill},
+            upsert=True
+        ))
+    
+    if operations:
+        try:
+            await bills_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Another request inserted the same instances first
+            if any(err["code"] != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+def next_month(month):
+    return month_range(month)["$lt"].strftime("%Y-%m")
+
+async def generate_recurring_bills_ahead(month, parent_ids=None):
+    """Generate a month's recurring bill instances and the next month's, so
+    upcoming bills exist before the month they are due in starts"""
+    await generate_recurring_bills(month, parent_ids)
+    await generate_recurring_bills(next_month(month), parent_ids)
+
+async def generate_new_recurring_bill(parent_id):
+    """Generate this and next month's instances of a recurring bill that was just saved.
+    
+    The bill itself is already stored, so a failure is only logged; the
+    scheduler generates later months.
+    """
+    try:
+        await generate_recurring_bills_ahead(datetime.utcnow().strftime("%Y-%m"), [parent_id])
     except Exception as e:
         print(f"Error generating recurring bills: {str(e)}")
 
+# Scheduled jobs
+# Each job runs at most once per month across all uvicorn workers: a worker
+# takes a short lease on the job's document in scheduled_jobs before running it.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+JOB_LEASE_SECONDS = 300
+SCHEDULER_INTERVAL_SECONDS = 3600
+
+async def run_once_per_month(job_name, job):
+    """Run job(month) for the current month unless it already ran or another worker holds the lease"""
+    now = datetime.utcnow()
+    month = now.strftime("%Y-%m")
+    try:
+        await jobs_collection.update_one(
+            {"_id": job_name, "lastRunMonth": {"$ne": month}, "lockedUntil": {"$not": {"$gt": now}}},
+            {"$set": {"lockedUntil": now + timedelta(seconds=JOB_LEASE_SECONDS), "lockedBy": WORKER_ID}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Already ran this month, or another worker is running it
+        return False
+    
+    try:
+        await job(month)
+    except Exception:
+        await jobs_collection.update_one({"_id": job_name}, {"$set": {"lockedUntil": None}})
+        raise
+    await jobs_collection.update_one(
+        {"_id": job_name},
+        {"$set": {"lastRunMonth": month, "lastRunAt": datetime.utcnow(), "lockedUntil": None}}
+    )
+    return True
+
+def seconds_until_next_month():
+    now = datetime.utcnow()
+    next_month = (now.replace(day=28) + timedelta(days=4)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return (next_month - now).total_seconds()
+
+async def recurring_bills_scheduler():
+    """Generate recurring bill instances once a month, at the month boundary.
+    
+    Each run covers the month that just started and the next one, so bills
+    show up a month ahead of time. The first pass runs at startup and catches
+    up on a month that was missed while no worker was running.
+    """
+    while True:
+        try:
+            await run_once_per_month("recurring-bills", generate_recurring_bills_ahead)
+        except Exception as e:
+            print(f"Error in recurring bills scheduler: {str(e)}")
+        await asyncio.sleep(max(1, min(seconds_until_next_month(), SCHEDULER_INTERVAL_SECONDS)))
+
 # Bills
 @app.get("/api/bills")
-async def get_bills(status: Optional[str] = None):
-    # Auto-generate recurring bills for current month
-    await generate_recurring_bills()
-    
-    query = {}
+async def get_bills(status: Optional[str] = None, fields: Optional[str] = None, user_id: str = Depends(current_user_id)):
+    # Recurring instances are generated by recurring_bills_scheduler and when
+    # a recurring bill is created, so listing is a plain read
+    query = {"userId": user_id}
     if status == "unpaid":
         query["isPaid"] = False
     elif status == "paid":
@@ -583,33 +2277,39 @@ async def get_bills(status: Optional[str] = None):
         {"isRecurring": True, "parentBillId": None}  # Include parent for management
     ]
     
-    bills = await bills_collection.find(query).sort("dueDate", 1).to_list(length=1000)
-    return {"bills": [serialize_doc(b) for b in bills]}
+    projection = fields_projection(fields, BILL_FIELDS)
+    bills = await bills_collection.find(query, projection).sort("dueDate", 1).to_list(length=1000)
+    return MongoJSONResponse({"bills": bills})
 
 @app.post("/api/bills")
-async def create_bill(bill: Bill):
-    result = await bills_collection.insert_one(bill.dict())
-    new_bill = await bills_collection.find_one({"_id": result.inserted_id})
-    return {"bill": serialize_doc(new_bill)}
+async def create_bill(bill: Bill, user_id: str = Depends(current_user_id)):
+    doc = bill_doc(bill, user_id)
+    await bills_collection.insert_one(doc)  # sets doc["_id"]
+    if bill.isRecurring and bill.parentBillId is None:
+        await generate_new_recurring_bill(doc["_id"])
+    return {"bill": serialize_doc(await written_doc(bills_collection, doc, BILL_FIELDS))}
 
 @app.put("/api/bills/{bill_id}")
-async def update_bill(bill_id: str, bill: Bill):
+async def update_bill(bill_id: str, bill: Bill, user_id: str = Depends(current_user_id)):
     try:
-        result = await bills_collection.update_one(
-            {"_id": ObjectId(bill_id)},
-            {"$set": bill.dict()}
+        updated_bill = await bills_collection.find_one_and_update(
+            {"_id": ObjectId(bill_id), "userId": user_id},
+            {"$set": bill_doc(bill, user_id)},
+            projection=dict.fromkeys(BILL_FIELDS, 1),
+            return_document=ReturnDocument.AFTER
         )
-        if result.matched_count == 0:
+        if not updated_bill:
             raise HTTPException(status_code=404, detail="Bill not found")
-        updated_bill = await bills_collection.find_one({"_id": ObjectId(bill_id)})
+        if bill.isRecurring and bill.parentBillId is None:
+            await generate_new_recurring_bill(ObjectId(bill_id))
         return {"bill": serialize_doc(updated_bill)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/api/bills/{bill_id}")
-async def delete_bill(bill_id: str):
+async def delete_bill(bill_id: str, user_id: str = Depends(current_user_id)):
     try:
-        result = await bills_collection.delete_one({"_id": ObjectId(bill_id)})
+        result = await bills_collection.delete_one({"_id": ObjectId(bill_id), "userId": user_id})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Bill not found")
         return {"message": "Bill deleted successfully"}
@@ -618,34 +2318,113 @@ async def delete_bill(bill_id: str):
 
 # UPI Payments
 @app.get("/api/upi-payments")
-async def get_upi_payments():
-    payments = await upi_payments_collection.find().sort("date", -1).to_list(length=1000)
-    return {"payments": [serialize_doc(p) for p in payments]}
+async def get_upi_payments(fields: Optional[str] = None, user_id: str = Depends(current_user_id)):
+    projection = fields_projection(fields, UPI_PAYMENT_FIELDS)
+    payments = await upi_payments_collection.find({"userId": user_id}, projection).sort("date", -1).to_list(length=1000)
+    return MongoJSONResponse({"payments": payments})
 
 @app.post("/api/upi-payments")
-async def create_upi_payment(payment: UPIPayment):
-    result = await upi_payments_collection.insert_one(payment.dict())
-    new_payment = await upi_payments_collection.find_one({"_id": result.inserted_id})
-    return {"payment": serialize_doc(new_payment)}
+async def create_upi_payment(payment: UPIPayment, user_id: str = Depends(current_user_id)):
+    doc = {**payment.dict(), "userId": user_id}
+    await upi_payments_collection.insert_one(doc)  # sets doc["_id"]
+    return {"payment": serialize_doc(await written_doc(upi_payments_collection, doc, UPI_PAYMENT_FIELDS))}
+
+# Analytics queries
+# Analytics endpoints fetch their data through run_queries(), which runs the
+# independent reads concurrently and reports how long each one took in the
+# Server-Timing response header.
+async def timed_query(name, query, timings):
+    start = time.perf_counter()
+    try:
+        return await query
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+async def run_queries(response: Response, **queries):
+    """Await the named queries concurrently and return their results by name"""
+    timings = {}
+    names = list(queries)
+    results = await asyncio.gather(*[timed_query(name, queries[name], timings) for name in names])
+    response.headers["Server-Timing"] = ", ".join(f"{name};dur={timings[name]:.1f}" for name in names)
+    return dict(zip(names, results))
+
+async def find_rollups(user_id, query=None):
+    return await rollups_collection.find({"userId": user_id, **(query or {})}).to_list(length=None)
+
+async def aggregate_rollups(user_id, pipeline):
+    return await rollups_collection.aggregate([{"$match": {"userId": user_id}}] + pipeline).to_list(length=None)
+
+async def find_month_bills(user_id, month):
+    return await bills_collection.find({"userId": user_id, "dueAt": month_range(month)}).to_list(length=1000)
+
+async def find_recurring_bills(user_id):
+    return await bills_collection.find(
+        {"userId": user_id, "isRecurring": True, "parentBillId": None}
+    ).to_list(length=1000)
+
+async def find_all_bills(user_id):
+    return await bills_collection.find({"userId": user_id}).to_list(length=1000)
+
+# AI insights cache
+# Insights are keyed on a fingerprint of the user and the data sent to the LLM
+# (plus the prompt version), so any transaction or bill write that changes
+# that data changes the key and the stale entry is simply never read again. Entries
+# live in an in-process TTL/LRU cache backed by a Mongo collection with a TTL
+# index, so they survive restarts and are shared between workers.
+AI_INSIGHTS_PROMPT_VERSION = "1"
+AI_INSIGHTS_CACHE_TTL_SECONDS = int(os.getenv("AI_INSIGHTS_CACHE_TTL_SECONDS", 6 * 60 * 60))
+ai_insights_cache = TTLCache(maxsize=int(os.getenv("AI_INSIGHTS_CACHE_SIZE", 256)), ttl=AI_INSIGHTS_CACHE_TTL_SECONDS)
+
+def insights_fingerprint(user_id, analysis_data):
+    payload = json.dumps(
+        {"prompt_version": AI_INSIGHTS_PROMPT_VERSION, "user": user_id, "data": analysis_data},
+        sort_keys=True,
+        default=json_default
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def get_cached_insights(key):
+    """Return the cached {insights, generated_at} for key, or None"""
+    if key in ai_insights_cache:
+        return ai_insights_cache[key]
+    expires_before = datetime.utcnow() - timedelta(seconds=AI_INSIGHTS_CACHE_TTL_SECONDS)
+    doc = await insights_cache_collection.find_one({"_id": key, "createdAt": {"$gt": expires_before}})
+    if not doc:
+        return None
+    entry = {"insights": doc["insights"], "generated_at": doc["generated_at"]}
+    ai_insights_cache[key] = entry
+    return entry
+
+async def store_insights(key, entry):
+    ai_insights_cache[key] = entry
+    await insights_cache_collection.replace_one(
+        {"_id": key},
+        {**entry, "createdAt": datetime.utcnow()},
+        upsert=True
+    )
 
 # Analytics
 @app.get("/api/analytics/summary")
-async def get_summary(month: Optional[str] = None):
-    query = {}
+async def get_summary(response: Response, month: Optional[str] = None, user_id: str = Depends(current_user_id)):
+    pipeline = []
     if month:
-        query["date"] = {"$regex": f"^{month}"}
+        month_range(month)  # validate YYYY-MM
+        pipeline.append({"$match": {"month": month}})
+    pipeline.append({"$group": {
+        "_id": {"type": "$type", "category": "$category"},
+        "total": {"$sum": "$total"}
+    }})
     
-    transactions = await transactions_collection.find(query).to_list(length=10000)
+    totals = (await run_queries(response, totals=aggregate_rollups(user_id, pipeline)))["totals"]
     
-    total_income = sum(t["amount"] for t in transactions if t["type"] == "income")
-    total_expense = sum(t["amount"] for t in transactions if t["type"] == "expense")
+    total_income = sum(r["total"] for r in totals if r["_id"]["type"] == "income")
+    total_expense = sum(r["total"] for r in totals if r["_id"]["type"] == "expense")
     
     # Category breakdown
-    category_breakdown = {}
-    for t in transactions:
-        if t["type"] == "expense":
-            category = t["category"]
-            category_breakdown[category] = category_breakdown.get(category, 0) + t["amount"]
+    category_breakdown = {
+        r["_id"]["category"]: r["total"]
+        for r in totals if r["_id"]["type"] == "expense"
+    }
     
     return {
         "totalIncome": total_income,
@@ -655,70 +2434,65 @@ async def get_summary(month: Optional[str] = None):
     }
 
 @app.get("/api/analytics/monthly-chart")
-async def get_monthly_chart():
-    # Get last 6 months data
-    transactions = await transactions_collection.find().to_list(length=10000)
-    
-    monthly_data = {}
-    for t in transactions:
-        month = t["date"][:7]  # YYYY-MM
-        if month not in monthly_data:
-            monthly_data[month] = {"income": 0, "expense": 0}
-        
-        if t["type"] == "income":
-            monthly_data[month]["income"] += t["amount"]
-        else:
-            monthly_data[month]["expense"] += t["amount"]
-    
-    # Sort by month and get last 6
-    sorted_months = sorted(monthly_data.keys(), reverse=True)[:6]
-    sorted_months.reverse()
+async def get_monthly_chart(response: Response, user_id: str = Depends(current_user_id)):
+    # Get last 6 months data, grouped and sorted by MongoDB
+    pipeline = [
+        {"$group": {
+            "_id": "$month",
+            "income": {"$sum": {"$cond": [{"$eq": ["$type", "income"]}, "$total", 0]}},
+            "expense": {"$sum": {"$cond": [{"$eq": ["$type", "income"]}, 0, "$total"]}}
+        }},
+        {"$sort": {"_id": -1}},
+        {"$limit": 6},
+        {"$sort": {"_id": 1}}
+    ]
+    months = (await run_queries(response, months=aggregate_rollups(user_id, pipeline)))["months"]
     
     chart_data = []
-    for month in sorted_months:
+    for m in months:
         chart_data.append({
-            "month": month,
-            "income": monthly_data[month]["income"],
-            "expense": monthly_data[month]["expense"]
+            "month": m["_id"],
+            "income": m["income"],
+            "expense": m["expense"]
         })
     
     return {"data": chart_data}
 
 @app.get("/api/analytics/amount-required")
-async def get_amount_required():
+async def get_amount_required(response: Response, user_id: str = Depends(current_user_id)):
     """Calculate amount required: recurring bills (unpaid) + current month expenses - paid bills"""
     try:
         current_month = datetime.utcnow().strftime("%Y-%m")
         
-        # Get current month transactions (expenses only)
-        transactions = await transactions_collection.find({
-            "date": {"$regex": f"^{current_month}"},
-            "type": "expense"
-        }).to_list(length=10000)
-        
-        current_month_expenses = sum(t["amount"] for t in transactions)
+        data = await run_queries(
+            response,
+            rollups=find_rollups(user_id, {"month": current_month, "type": "expense"}),
+            bills=find_month_bills(user_id, current_month),
+            recurring_bills=find_recurring_bills(user_id)
+        )
         
-        # Get all bills for current month
-        bills = await bills_collection.find({
-            "dueDate": {"$regex": f"^{current_month}"}
-        }).to_list(length=1000)
+        # Current month expenses
+        current_month_expenses = sum(r["total"] for r in data["rollups"])
         
+        # All bills for current month
+        bills = data["bills"]
         unpaid_bills = sum(b["amount"] for b in bills if not b.get("isPaid", False))
         paid_bills = sum(b["amount"] for b in bills if b.get("isPaid", False))
         
-        # Get recurring bills (parent bills)
-        recurring_bills = await bills_collection.find({
-            "isRecurring": True,
-            "parentBillId": None
-        }).to_list(length=1000)
+        # Recurring bills (parent bills)
+        recurring_bills = data["recurring_bills"]
+        
+        # This month's generated instances are already in `bills`; index them
+        # by parent instead of querying once per recurring bill
+        month_instances = {}
+        for b in bills:
+            if b.get("parentBillId"):
+                month_instances.setdefault(b["parentBillId"], b)
         
         recurring_unpaid = 0
         for rb in recurring_bills:
             # Check if this month's instance is paid
-            month_bill = await bills_collection.find_one({
-                "parentBillId": str(rb["_id"]),
-                "dueDate": {"$regex": f"^{current_month}"}
-            })
+            month_bill = month_instances.get(str(rb["_id"]))
             if month_bill and not month_bill.get("isPaid", False):
                 recurring_unpaid += month_bill["amount"]
             elif not month_bill:
@@ -740,7 +2514,7 @@ async def get_amount_required():
         raise HTTPException(status_code=500, detail=f"Amount required calculation failed: {str(e)}")
 
 @app.get("/api/analytics/pocket-money")
-async def get_pocket_money():
+async def get_pocket_money(response: Response, user_id: str = Depends(current_user_id)):
     """Calculate pocket money: income - recurring bills - current month bills - other expenses"""
     try:
         current_month = datetime.utcnow().strftime("%Y-%m")
@@ -750,30 +2524,26 @@ async def get_pocket_money():
         days_passed = current_date.day
         days_remaining = total_days - days_passed + 1
         
-        # Get total income for current month
-        transactions = await transactions_collection.find({
-            "date": {"$regex": f"^{current_month}"}
-        }).to_list(length=10000)
+        data = await run_queries(
+            response,
+            rollups=find_rollups(user_id, {"month": current_month}),
+            bills=find_month_bills(user_id, current_month),
+            recurring_bills=find_recurring_bills(user_id)
+        )
         
-        total_income = sum(t["amount"] for t in transactions if t["type"] == "income")
-        total_expense = sum(t["amount"] for t in transactions if t["type"] == "expense")
+        # Get total income for current month
+        rollups = data["rollups"]
+        total_income = sum(r["total"] for r in rollups if r["type"] == "income")
+        total_expense = sum(r["total"] for r in rollups if r["type"] == "expense")
         
         # Get current month bills (paid and unpaid)
-        bills = await bills_collection.find({
-            "dueDate": {"$regex": f"^{current_month}"}
-        }).to_list(length=1000)
-        
+        bills = data["bills"]
         total_bills = sum(b["amount"] for b in bills)
         paid_bills = sum(b["amount"] for b in bills if b.get("isPaid", False))
         unpaid_bills = total_bills - paid_bills
         
         # Get recurring bills amount (estimate for future months)
-        recurring_bills = await bills_collection.find({
-            "isRecurring": True,
-            "parentBillId": None
-        }).to_list(length=1000)
-        
-        total_recurring = sum(b["amount"] for b in recurring_bills)
+        total_recurring = sum(b["amount"] for b in data["recurring_bills"])
         
         # Calculate pocket money
         pocket_money = total_income - total_expense - unpaid_bills
@@ -796,87 +2566,97 @@ async def get_pocket_money():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Pocket money calculation failed: {str(e)}")
 
-@app.get("/api/analytics/ai-insights")
-async def get_ai_insights():
-    """Get AI-powered financial insights and recommendations"""
-    try:
-        current_month = datetime.utcnow().strftime("%Y-%m")
-        
-        # Get last 3 months of data for better analysis
-        three_months_ago = (datetime.utcnow() - timedelta(days=90)).strftime("%Y-%m")
-        
-        # Fetch all relevant data
-        transactions = await transactions_collection.find({
-            "date": {"$gte": three_months_ago}
-        }).to_list(length=10000)
-        
-        bills = await bills_collection.find().to_list(length=1000)
-        
-        # Calculate key metrics
-        total_income = sum(t["amount"] for t in transactions if t["type"] == "income")
-        total_expenses = sum(t["amount"] for t in transactions if t["type"] == "expense")
-        
-        # Get recurring bills (loans/EMIs)
-        recurring_bills = [b for b in bills if b.get("isRecurring", False)]
-        loan_bills = [b for b in recurring_bills if any(keyword in b["name"].lower() for keyword in ["loan", "emi", "credit"])]
-        
-        # Calculate monthly averages
-        months_data = {}
-        for t in transactions:
-            month = t["date"][:7]
-            if month not in months_data:
-                months_data[month] = {"income": 0, "expense": 0}
-            if t["type"] == "income":
-                months_data[month]["income"] += t["amount"]
-            else:
-                months_data[month]["expense"] += t["amount"]
-        
-        avg_monthly_income = sum(m["income"] for m in months_data.values()) / len(months_data) if months_data else 0
-        avg_monthly_expense = sum(m["expense"] for m in months_data.values()) / len(months_data) if months_data else 0
-        
-        # Category-wise spending
-        category_spending = {}
-        for t in transactions:
-            if t["type"] == "expense":
-                cat = t.get("category", "Other")
-                category_spending[cat] = category_spending.get(cat, 0) + t["amount"]
-        
-        # Prepare data for AI analysis
-        analysis_data = {
-            "total_income": total_income,
-            "total_expenses": total_expenses,
-            "avg_monthly_income": avg_monthly_income,
-            "avg_monthly_expense": avg_monthly_expense,
-            "monthly_savings": avg_monthly_income - avg_monthly_expense,
-            "loan_bills": [{"name": b["name"], "amount": b["amount"]} for b in loan_bills],
-            "recurring_bills": [{"name": b["name"], "amount": b["amount"]} for b in recurring_bills],
-            "category_spending": category_spending,
-            "months_count": len(months_data)
+async def collect_insights_data(response: Response, user_id):
+    """Summarise the last 3 months of data into the analysis_data sent to the LLM"""
+    # Get last 3 months of data for better analysis
+    three_months_ago = (datetime.utcnow() - timedelta(days=90)).strftime("%Y-%m")
+    
+    # Fetch all relevant data
+    data = await run_queries(
+        response,
+        rollups=find_rollups(user_id, {"month": {"$gte": three_months_ago}}),
+        bills=find_all_bills(user_id)
+    )
+    rollups = data["rollups"]
+    bills = data["bills"]
+    
+    # Calculate key metrics
+    total_income = sum(r["total"] for r in rollups if r["type"] == "income")
+    total_expenses = sum(r["total"] for r in rollups if r["type"] == "expense")
+    
+    # Get recurring bills (loans/EMIs)
+    recurring_bills = [b for b in bills if b.get("isRecurring", False)]
+    loan_bills = [b for b in recurring_bills if any(keyword in b["name"].lower() for keyword in ["loan", "emi", "credit"])]
+    
+    # Calculate monthly averages
+    months_data = {}
+    for r in rollups:
+        month = r["month"]
+        if month not in months_data:
+            months_data[month] = {"income": 0, "expense": 0}
+        if r["type"] == "income":
+            months_data[month]["income"] += r["total"]
+        else:
+            months_data[month]["expense"] += r["total"]
+    
+    avg_monthly_income = sum(m["income"] for m in months_data.values()) / len(months_data) if months_data else 0
+    avg_monthly_expense = sum(m["expense"] for m in months_data.values()) / len(months_data) if months_data else 0
+    
+    # Category-wise spending
+    category_spending = {}
+    for r in rollups:
+        if r["type"] == "expense":
+            cat = r["category"]
+            category_spending[cat] = category_spending.get(cat, 0) + r["total"]
+    
+    # Prepare data for AI analysis
+    analysis_data = {
+        "total_income": total_income,
+        "total_expenses": total_expenses,
+        "avg_monthly_income": avg_monthly_income,
+        "avg_monthly_expense": avg_monthly_expense,
+        "monthly_savings": avg_monthly_income - avg_monthly_expense,
+        "loan_bills": [{"name": b["name"], "amount": b["amount"]} for b in loan_bills],
+        "recurring_bills": [{"name": b["name"], "amount": b["amount"]} for b in recurring_bills],
+        "category_spending": category_spending,
+        "months_count": len(months_data)
+    }
+    return analysis_data
+
+async def generate_insights(user_id, analysis_data):
+    """Return insights for analysis_data from the cache, or from the LLM"""
+    # Serve unchanged data from the cache instead of calling the LLM again
+    cache_key = insights_fingerprint(user_id, analysis_data)
+    cached = await get_cached_insights(cache_key)
+    if cached:
+        return {
+            "insights": cached["insights"],
+            "data_summary": analysis_data,
+            "generated_at": cached["generated_at"],
+            "cached": True
         }
-        
-        # Use AI to generate insights
-        api_key = os.getenv("EMERGENT_LLM_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="API key not configured")
-        
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"ai-insights-{datetime.utcnow().timestamp()}",
-            system_message="You are a professional financial advisor AI. Analyze user's financial data and provide actionable insights."
-        ).with_model("openai", "gpt-4o-mini")
-        
-        prompt = f"""Analyze this financial data and provide comprehensive insights:
+    
+    # Use AI to generate insights
+    if not llm_configured():
+        raise HTTPException(status_code=500, detail="API key not configured")
+    
+    chat = new_chat(
+        "ai-insights",
+        "You are a professional financial advisor AI. Analyze user's financial data and provide actionable insights."
+    )
+    
+    prompt = f"""Analyze this financial data and provide comprehensive insights:
 
 Income & Expenses:
-- Average Monthly Income: ₹{avg_monthly_income:.2f}
-- Average Monthly Expense: ₹{avg_monthly_expense:.2f}
+- Average Monthly Income: ₹{analysis_data['avg_monthly_income']:.2f}
+- Average Monthly Expense: ₹{analysis_data['avg_monthly_expense']:.2f}
 - Monthly Savings: ₹{analysis_data['monthly_savings']:.2f}
 
 Loans/EMIs:
 {chr(10).join([f"- {loan['name']}: ₹{loan['amount']}/month" for loan in analysis_data['loan_bills']]) if analysis_data['loan_bills'] else "- No loans detected"}
 
 Category-wise Spending:
-{chr(10).join([f"- {cat}: ₹{amt:.2f}" for cat, amt in sorted(category_spending.items(), key=lambda x: x[1], reverse=True)[:5]])}
+{chr(10).join([f"- {cat}: ₹{amt:.2f}" for cat, amt in sorted(analysis_data['category_spending'].items(), key=lambda x: x[1], reverse=True)[:5]])}
 
 Provide analysis in this EXACT JSON format:
 {{
@@ -907,47 +2687,201 @@ Provide analysis in this EXACT JSON format:
 
 Be specific with numbers and actionable. Focus on Indian context (₹)."""
 
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        # Parse AI response
-        import json
-        # Extract JSON from response (handle markdown code blocks)
-        json_str = response
-        if "```json" in response:
-            json_str = response.split("```json")[1].split("```")[0].strip()
-        elif "```" in response:
-            json_str = response.split("```")[1].split("```")[0].strip()
-        
-        try:
-            insights = json.loads(json_str)
-        except:
-            # Fallback if JSON parsing fails
-            insights = {
-                "loan_payoff_strategy": {
-                    "current_timeline": "Analysis pending",
-                    "accelerated_timeline": "Analysis pending",
-                    "recommendation": response[:200]
-                },
-                "savings_opportunities": [],
-                "spending_insights": ["AI analysis in progress"],
-                "financial_health_score": 70,
-                "top_recommendations": ["Continue tracking expenses", "Review spending patterns"],
-                "future_projection": {
-                    "6_months": "Steady progress expected",
-                    "1_year": "Financial improvement likely"
-                }
+    user_message = UserMessage(text=prompt)
+    response = await chat.send_message(user_message)
+    
+    # Parse AI response
+    # Extract JSON from response (handle markdown code blocks)
+    json_str = response
+    if "```json" in response:
+        json_str = response.split("```json")[1].split("```")[0].strip()
+    elif "```" in response:
+        json_str = response.split("```")[1].split("```")[0].strip()
+    
+    try:
+        insights = json.loads(json_str)
+        parsed = True
+    except:
+        # Fallback if JSON parsing fails
+        parsed = False
+        insights = {
+            "loan_payoff_strategy": {
+                "current_timeline": "Analysis pending",
+                "accelerated_timeline": "Analysis pending",
+                "recommendation": response[:200]
+            },
+            "savings_opportunities": [],
+            "spending_insights": ["AI analysis in progress"],
+            "financial_health_score": 70,
+            "top_recommendations": ["Continue tracking expenses", "Review spending patterns"],
+            "future_projection": {
+                "6_months": "Steady progress expected",
+                "1_year": "Financial improvement likely"
             }
-        
-        return {
-            "insights": insights,
-            "data_summary": analysis_data,
-            "generated_at": datetime.utcnow().isoformat()
         }
-        
+    
+    generated_at = datetime.utcnow().isoformat()
+    if parsed:
+        # Don't cache the fallback, so the next request retries the LLM
+        await store_insights(cache_key, {"insights": insights, "generated_at": generated_at})
+    
+    return {
+        "insights": insights,
+        "data_summary": analysis_data,
+        "generated_at": generated_at,
+        "cached": False
+    }
+
+@app.get("/api/analytics/ai-insights")
+async def get_ai_insights(response: Response, user_id: str = Depends(current_user_id)):
+    """Get AI-powered financial insights and recommendations"""
+    try:
+        analysis_data = await collect_insights_data(response, user_id)
+        return await generate_insights(user_id, analysis_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI insights generation failed: {str(e)}")
 
+# AI insights jobs
+# POST enqueues an insights job and returns its id straight away; a bounded
+# pool of background workers makes the LLM calls. Job state is kept in Mongo
+# so any uvicorn worker can answer polls, and a request whose data matches a
+# job that is still queued or running gets that job instead of a new one.
+# The queue itself is in memory, so a job still queued or running after
+# AI_INSIGHTS_JOB_TIMEOUT_SECONDS was lost (e.g. its worker restarted) and is
+# reported as failed.
+AI_INSIGHTS_WORKERS = int(os.getenv("AI_INSIGHTS_WORKERS", 2))
+AI_INSIGHTS_QUEUE_SIZE = int(os.getenv("AI_INSIGHTS_QUEUE_SIZE", 100))
+AI_INSIGHTS_JOB_TIMEOUT_SECONDS = 600
+AI_INSIGHTS_POLL_SECONDS = 0.5
+insights_queue = asyncio.Queue(maxsize=AI_INSIGHTS_QUEUE_SIZE)
+insights_jobs_lock = asyncio.Lock()
+
+def insights_job_expired(job):
+    return (job["status"] in ("queued", "running")
+            and job["createdAt"] < datetime.utcnow() - timedelta(seconds=AI_INSIGHTS_JOB_TIMEOUT_SECONDS))
+
+def insights_job_response(job):
+    if insights_job_expired(job):
+        job = {**job, "status": "failed", "error": "AI insights job timed out"}
+    data = {"jobId": job["_id"], "status": job["status"]}
+    if job["status"] == "done":
+        data["result"] = job["result"]
+    elif job["status"] == "failed":
+        data["error"] = job["error"]
+    return data
+
+async def fail_stale_insights_jobs():
+    """Startup: mark jobs that timed out in the queue of an earlier process as failed"""
+    timed_out = datetime.utcnow() - timedelta(seconds=AI_INSIGHTS_JOB_TIMEOUT_SECONDS)
+    result = await insights_jobs_collection.update_many(
+        {"status": {"$in": ["queued", "running"]}, "createdAt": {"$lt": timed_out}},
+        {"$set": {"status": "failed", "error": "AI insights job timed out", "finishedAt": datetime.utcnow()}}
+    )
+    return result.modified_count
+
+async def insights_worker():
+    while True:
+        job_id, user_id, analysis_data = await insights_queue.get()
+        try:
+            await insights_jobs_collection.update_one({"_id": job_id}, {"$set": {"status": "running"}})
+            result = await generate_insights(user_id, analysis_data)
+            await insights_jobs_collection.update_one(
+                {"_id": job_id},
+                {"$set": {"status": "done", "result": result, "finishedAt": datetime.utcnow()}}
+            )
+        except Exception as e:
+            await insights_jobs_collection.update_one(
+                {"_id": job_id},
+                {"$set": {"status": "failed", "error": f"AI insights generation failed: {str(e)}", "finishedAt": datetime.utcnow()}}
+            )
+        finally:
+            insights_queue.task_done()
+
+@app.post("/api/analytics/ai-insights/jobs")
+async def create_ai_insights_job(response: Response, user_id: str = Depends(current_user_id)):
+    """Queue an AI insights job; poll or subscribe to its result by jobId"""
+    try:
+        analysis_data = await collect_insights_data(response, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"AI insights generation failed: {str(e)}")
+    key = insights_fingerprint(user_id, analysis_data)
+    
+    async with insights_jobs_lock:
+        # Share an identical job that is still in flight
+        in_flight_since = datetime.utcnow() - timedelta(seconds=AI_INSIGHTS_JOB_TIMEOUT_SECONDS)
+        existing = await insights_jobs_collection.find_one({
+            "userId": user_id,
+            "key": key,
+            "status": {"$in": ["queued", "running"]},
+            "createdAt": {"$gt": in_flight_since}
+        })
+        if existing:
+            return insights_job_response(existing)
+        
+        job = {"_id": uuid.uuid4().hex, "userId": user_id, "key": key, "status": "queued", "createdAt": datetime.utcnow()}
+        
+        # Cached insights don't need a worker
+        if await get_cached_insights(key):
+            job.update(status="done", result=await generate_insights(user_id, analysis_data), finishedAt=datetime.utcnow())
+            await insights_jobs_collection.insert_one(job)
+            return insights_job_response(job)
+        
+        if insights_queue.full():
+            raise HTTPException(status_code=503, detail="Too many AI insights jobs queued, try again later")
+        await insights_jobs_collection.insert_one(job)
+        insights_queue.put_nowait((job["_id"], user_id, analysis_data))
+    
+    return insights_job_response(job)
+
+@app.get("/api/analytics/ai-insights/jobs/{job_id}")
+async def get_ai_insights_job(job_id: str, user_id: str = Depends(current_user_id)):
+    job = await insights_jobs_collection.find_one({"_id": job_id, "userId": user_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return insights_job_response(job)
+
+@app.get("/api/analytics/ai-insights/jobs/{job_id}/events")
+async def stream_ai_insights_job(job_id: str, user_id: str = Depends(current_user_id)):
+    """Server-sent events: one event per status change, ending with done or failed"""
+    if not await insights_jobs_collection.find_one({"_id": job_id, "userId": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def events():
+        last_status = None
+        while True:
+            job = await insights_jobs_collection.find_one({"_id": job_id})
+            if not job:
+                # Deleted by the TTL index while we were streaming
+                data = {"jobId": job_id, "status": "failed", "error": "Job not found"}
+            else:
+                data = insights_job_response(job)
+            if data["status"] != last_status:
+                last_status = data["status"]
+                yield f"event: {last_status}\ndata: {json.dumps(data, default=json_default)}\n\n"
+            if last_status in ("done", "failed"):
+                return
+            await asyncio.sleep(AI_INSIGHTS_POLL_SECONDS)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild-rollups":
+        # python server.py rebuild-rollups
+        count = asyncio.run(rebuild_rollups())
+        print(f"Rebuilt {count} monthly rollups")
+    elif len(sys.argv) > 1 and sys.argv[1] == "migrate-dates":
+        # python server.py migrate-dates
+        count = asyncio.run(backfill_date_fields())
+        print(f"Backfilled dates on {count} documents")
+    elif len(sys.argv) > 2 and sys.argv[1] == "migrate-users":
+        # python server.py migrate-users owner@example.com
+        count = asyncio.run(assign_unowned_data(sys.argv[2]))
+        print(f"Assigned {count} documents to {sys.argv[2]}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "migrate-images":
+        # python server.py migrate-images
+        count = asyncio.run(migrate_receipt_images())
+        print(f"Moved {count} receipt images to the {RECEIPT_STORE} store")
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
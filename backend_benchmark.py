@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for Budget Planner API
+Seeds synthetic users, transactions and bills, drives the main endpoints at
+fixed concurrency and reports throughput and latency percentiles as JSON.
+Each transaction and bill belongs to a random seeded user, and requests are
+signed in as the users in turn.
+
+The app runs in-process (no uvicorn) with LLM_PROVIDER=fake, against either
+an in-memory mongomock database (default) or a real mongod:
+
+    python backend_benchmark.py --rows 1000
+    python backend_benchmark.py --rows 100000 --mongo-url mongodb://localhost:27017/
+    python backend_benchmark.py --rows 1000000 --mongo-url mongodb://localhost:27017/ --output bench.json
+
+With --mongo-url the data goes into a separate database (--db-name,
+budget_planner_bench by default) that is dropped at the end unless --keep is
+given. It refuses to use the app's own database (MONGO_DB_NAME, budget_planner
+by default). mongomock is pure Python and slow to seed, so use mongod beyond
+~100k rows; mongomock mode needs mongomock-motor, which is listed in
+backend/requirements.txt.
+
+Slow queries (SLOW_QUERY_MS) are summarised under "queryPlans" in the report.
+With mongod, --explain-sample-rate 1 explains every query and flags the ones
+that scan a whole collection.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+CATEGORIES = {
+    "income": ["Salary", "Business"],
+    "expense": ["Food", "Transport", "Shopping", "Bills", "Entertainment", "Health"],
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rows", type=int, default=1000, help="transactions to seed (e.g. 1000, 100000, 1000000)")
+    parser.add_argument("--bills", type=int, help="bills to seed (default: rows / 100, at least 20)")
+    parser.add_argument("--users", type=int, help="users to seed (default: rows / 1000, at least 10)")
+    parser.add_argument("--months", type=int, default=24, help="months of history to spread transactions over")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per endpoint")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per endpoint")
+    parser.add_argument("--mongo-url", help="run against this mongod instead of mongomock")
+    parser.add_argument("--db-name", default="budget_planner_bench", help="database to seed with --mongo-url")
+    parser.add_argument("--keep", action="store_true", help="don't drop the benchmark database afterwards")
+    parser.add_argument("--explain-sample-rate", type=float, default=0,
+                        help="explain this fraction of queries and report collection scans (needs --mongo-url)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the synthetic data")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+def load_server(args):
+    """Import backend/server.py configured for benchmarking"""
+    os.environ["LLM_PROVIDER"] = "fake"
+    os.environ["RECEIPT_STORE"] = "local"
+    os.environ["RECEIPT_STORE_PATH"] = tempfile.mkdtemp(prefix="receipts-")
+    os.environ["EXPLAIN_SAMPLE_RATE"] = str(args.explain_sample_rate)
+    if args.mongo_url:
+        # The benchmark drops its database, so never point it at the app's
+        if args.db_name == os.getenv("MONGO_DB_NAME", "budget_planner"):
+            sys.exit(f"--db-name {args.db_name} is the app's database and would be dropped; pick another name")
+        os.environ["MONGO_URL"] = args.mongo_url
+        os.environ["MONGO_DB_NAME"] = args.db_name
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock mode needs mongomock-motor: pip install -r backend/requirements.txt (or pass --mongo-url)")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *a, **kw: AsyncMongoMockClient()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    import server
+    return server
+
+async def insert_batches(collection, docs, batch_size=10000):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+
+async def seed(server, args):
+    """Insert synthetic data straight into MongoDB and rebuild derived data"""
+    rng = random.Random(args.seed)
+    today = datetime.utcnow()
+    users = args.users or max(10, args.rows // 1000)
+    bills = args.bills or max(20, args.rows // 100)
+    started = time.perf_counter()
+
+    # One bcrypt hash shared by every synthetic user
+    password = server.pwd_context.hash("benchmark-password")
+    await insert_batches(server.users_collection, (
+        {"email": f"user{i}@example.com", "password": password, "name": f"User {i}",
+         "createdAt": today.isoformat()}
+        for i in range(users)
+    ))
+    user_ids = [str(user["_id"]) async for user in server.users_collection.find({}, {"_id": 1})]
+
+    def transaction(i):
+        kind = "income" if rng.random() < 0.1 else "expense"
+        day = today - timedelta(days=rng.randrange(args.months * 30))
+        return server.transaction_doc(server.Transaction(
+            type=kind,
+            amount=round(rng.uniform(5000, 90000) if kind == "income" else rng.uniform(10, 5000), 2),
+            category=rng.choice(CATEGORIES[kind]),
+            description=f"Synthetic transaction {i}",
+            date=day.strftime("%Y-%m-%d"),
+            createdAt=day.isoformat(),
+        ), rng.choice(user_ids))
+    await insert_batches(server.transactions_collection, (transaction(i) for i in range(args.rows)))
+
+    def bill(i):
+        due = today + timedelta(days=rng.randrange(-60, 60))
+        recurring = i % 5 == 0
+        return server.bill_doc(server.Bill(
+            name=f"Synthetic bill {i}",
+            amount=round(rng.uniform(100, 20000), 2),
+            dueDate=due.strftime("%Y-%m-%d"),
+            isPaid=rng.random() < 0.5,
+            category=rng.choice(["Credit Card", "Loan", "Utilities", "Rent"]),
+            isRecurring=recurring,
+            recurringDay=due.day if recurring else None,
+        ), rng.choice(user_ids))
+    await insert_batches(server.bills_collection, (bill(i) for i in range(bills)))
+
+    await server.rebuild_rollups()
+    await server.generate_recurring_bills()
+    return {
+        "users": users,
+        "transactions": args.rows,
+        "bills": await server.bills_collection.count_documents({}),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+def endpoints():
+    month = datetime.utcnow().strftime("%Y-%m")
+    return [
+        "/api/transactions?limit=100",
+        f"/api/transactions?month={month}&limit=100",
+        "/api/transactions?type=expense&limit=100&fields=amount,category,date",
+        "/api/bills",
+        "/api/bills?status=unpaid",
+        "/api/analytics/summary",
+        f"/api/analytics/summary?month={month}",
+        "/api/analytics/monthly-chart",
+        "/api/analytics/amount-required",
+        "/api/analytics/pocket-money",
+        "/api/analytics/ai-insights",
+    ]
+
+async def query_plans(server, seed_done):
+    """Slow and collection-scanning queries seen while driving the endpoints"""
+    if server.explain_tasks:
+        await asyncio.wait(list(server.explain_tasks))
+    queries = {}
+    for entry in server.slow_query_log:
+        if entry["at"] < seed_done or entry["route"] == "background":
+            continue
+        key = (entry["route"], entry["collection"], entry["operation"], json.dumps(entry["filter"]))
+        summary = queries.setdefault(key, {
+            "route": entry["route"],
+            "collection": entry["collection"],
+            "operation": entry["operation"],
+            "filter": entry["filter"],
+            "count": 0,
+            "maxDurationMs": 0,
+            "maxDocsExamined": None,
+            "collscan": False,
+        })
+        summary["count"] += 1
+        summary["maxDurationMs"] = max(summary["maxDurationMs"], entry["durationMs"])
+        if entry["docsExamined"] is not None:
+            summary["maxDocsExamined"] = max(summary["maxDocsExamined"] or 0, entry["docsExamined"])
+        summary["collscan"] = summary["collscan"] or bool(entry.get("collscan"))
+    return {
+        **server.query_plan_stats,
+        "queries": sorted(queries.values(), key=lambda q: -(q["maxDocsExamined"] or 0)),
+    }
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+async def run_endpoint(client, path, args, tokens):
+    """Issue args.requests GETs with args.concurrency in flight; return the stats
+
+    Requests rotate through the seeded users, so each one reads a single
+    user's share of the data.
+    """
+    sent = 0
+
+    def get():
+        nonlocal sent
+        sent += 1
+        token = tokens[sent % len(tokens)]
+        return client.get(path, headers={"Authorization": f"Bearer {token}"})
+
+    for _ in range(args.warmup):
+        await get()
+
+    timings, errors = [], 0
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await get()
+            timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "throughput_rps": round(len(timings) / elapsed, 1),
+        "mean_ms": round(statistics.mean(timings) * 1000, 2),
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+    }
+
+async def run(server, args):
+    import httpx
+
+    # Start from an empty database, before startup creates the indexes
+    if args.mongo_url:
+        await server.client.drop_database(args.db_name)
+    for handler in server.app.router.on_startup:
+        await handler()
+    try:
+        seeded = await seed(server, args)
+        print(f"Seeded {seeded}", file=sys.stderr)
+        seed_done = datetime.utcnow().isoformat()
+        tokens = [server.create_access_token({"sub": f"user{i}@example.com"}) for i in range(seeded["users"])]
+
+        results = {}
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            for path in endpoints():
+                results[path] = await run_endpoint(client, path, args, tokens)
+                print(f"{path:<70} p50 {results[path]['p50_ms']:>8} ms  p99 {results[path]['p99_ms']:>8} ms  "
+                      f"{results[path]['throughput_rps']:>8} req/s", file=sys.stderr)
+        plans = await query_plans(server, seed_done)
+    finally:
+        for handler in server.app.router.on_shutdown:
+            await handler()
+        if args.mongo_url and not args.keep:
+            await server.client.drop_database(args.db_name)
+    return seeded, results, plans
+
+async def main():
+    args = parse_args()
+    # Keep stdout for the JSON report; server logging goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        server = load_server(args)
+        seeded, results, plans = await run(server, args)
+
+    report = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "backend": "mongod" if args.mongo_url else "mongomock",
+        "config": {
+            "rows": args.rows,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "explain_sample_rate": args.explain_sample_rate,
+            "seed": args.seed,
+        },
+        "seeded": seeded,
+        "results": results,
+        "queryPlans": plans,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -32,11 +32,26 @@ interface AuthContextType {
 
 const AuthContext = createContext<AuthContextType | undefined>(undefined);
 
+// Transactions, bills and analytics are per user, so every API request
+// carries the token; it is set before any screen can fetch with it
+const setAuthHeader = (token: string | null) => {
+  if (token) {
+    axios.defaults.headers.common.Authorization = `Bearer ${token}`;
+  } else {
+    delete axios.defaults.headers.common.Authorization;
+  }
+};
+
 export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children }) => {
   const [user, setUser] = useState<User | null>(null);
-  const [token, setToken] = useState<string | null>(null);
+  const [token, setTokenState] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
 
+  const setToken = (value: string | null) => {
+    setAuthHeader(value);
+    setTokenState(value);
+  };
+
   // Check authentication status on mount
   useEffect(() => {
     checkAuth();
@@ -98,8 +98,17 @@ export const useBudgetStore = create<BudgetStore>((set, get) => ({
   fetchTransactions: async () => {
     try {
       set({ loading: true });
-      const response = await axios.get(`${API_URL}/api/transactions`);
-      set({ transactions: response.data.transactions, loading: false });
+      // The list is paged; follow nextCursor until the last page
+      const transactions: Transaction[] = [];
+      let cursor: string | null = null;
+      do {
+        const response: any = await axios.get(`${API_URL}/api/transactions`, {
+          params: cursor ? { cursor } : {},
+        });
+        transactions.push(...response.data.transactions);
+        cursor = response.data.nextCursor;
+      } while (cursor);
+      set({ transactions, loading: false });
     } catch (error) {
       console.error('Error fetching transactions:', error);
       set({ loading: false });